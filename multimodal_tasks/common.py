@@ -0,0 +1,92 @@
+"""
+Functions shared by the task yamls. Tasks reference them directly instead of
+keeping a copy in their own utils.py:
+
+    doc_to_text: !function ../common.doc_to_text
+    doc_to_image: !function ../common.doc_to_image
+    process_docs: !function ../common.process_docs_images
+
+A task with a different set of media fields builds its function with
+make_doc_to_media and keeps it here next to the others.
+"""
+from typing import Any, Callable, Dict, List, Sequence
+
+import os
+import sys
+
+# lm-eval executes every !function module by its file path, so the sibling modules
+# are not importable by default. They are imported once through sys.modules,
+# which keeps a single media config, cache and prefetcher for all tasks.
+TASKS_DIR = os.path.dirname(os.path.abspath(__file__))
+if TASKS_DIR not in sys.path:
+    sys.path.insert(0, TASKS_DIR)
+from load_media import get_audio, get_image, get_video, prepare_images  # noqa: E402
+
+
+def doc_to_text(doc: Dict[str, Any]) -> str:
+    """
+    Get the prompt for a given document: the instruction filled with all doc["inputs"] data.
+
+    :param doc: Dict[str, Any]
+        one dataset sample as dictionary
+
+    :return
+        one string - the prompt to be passed into LM
+    """
+    return doc["instruction"].format(**doc["inputs"])
+
+
+def doc_to_text_audio_pair(doc: Dict[str, Any]) -> str:
+    """
+    Get the prompt for a document with up to two audios (aquaria): the numbered
+    <audio_1> / <audio_2> tags are replaced with the plain <audio> tag.
+
+    :param doc: Dict[str, Any]
+        one dataset sample as dictionary
+
+    :return
+        one string - the prompt to be passed into LM
+    """
+    prompt = doc_to_text(doc)
+
+    for i in range(1, 3):
+        prompt = prompt.replace(f"<audio_{i}>", "<audio>")
+
+    return prompt
+
+
+def make_doc_to_media(loader: Callable[[Any], Any], keys: Sequence[str]) -> Callable[[Dict[str, Any]], List[Any]]:
+    """
+    Build doc_to_image / doc_to_audio / doc_to_video for a task.
+
+    :param loader: Callable
+        get_image, get_audio or get_video from load_media
+    :param keys: Sequence[str]
+        fields of doc["inputs"] with the media, in the order the model receives them
+        (the first one fills <image_1>, the second one <image_2> and so on)
+
+    :return
+        function taking a doc and returning the list of loaded media, empty fields are skipped
+    """
+    keys = tuple(keys)
+
+    def doc_to_media(doc: Dict[str, Any]) -> List[Any]:
+        inputs = doc["inputs"]
+        return [loader(inputs[key]) for key in keys if inputs.get(key) is not None]
+
+    return doc_to_media
+
+
+doc_to_image = make_doc_to_media(get_image, ["image"])
+doc_to_audio = make_doc_to_media(get_audio, ["audio"])
+doc_to_video = make_doc_to_media(get_video, ["video"])
+# aquaria: up to two audios per question
+doc_to_audio_pair = make_doc_to_media(get_audio, ["audio_1", "audio_2"])
+
+
+def process_docs_images(dataset):
+    """
+    Resize the images of doc["inputs"]["image"] for the whole split at once
+    (HARNESS_RESIZE_IMAGES), see load_media.prepare_images.
+    """
+    return prepare_images(dataset, ["image"])
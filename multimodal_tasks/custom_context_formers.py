@@ -1,8 +1,12 @@
 from lm_eval.api.samplers import ContextSampler
-from typing import Optional
+from typing import Dict, Optional, Tuple
+
+import collections
+import logging
+import os
 
 ### Copy of code from lm_eval_utils
-from jinja2 import BaseLoader, Environment, StrictUndefined
+from jinja2 import BaseLoader, Environment, StrictUndefined, Template
 import re
 
 
@@ -17,9 +21,35 @@ env = Environment(
 env.filters["regex_replace"] = regex_replace
 ### End of copy
 # TODO: make env creation a function to be imported
-# TODO: make rendering of envs a function to use it
+
+# compiled templates shared by all formers (and tasks) of the process, keyed by source
+_compiled_templates: Dict[str, Template] = {}
+template_stats = {"compilations": 0, "hits": 0}
+
+
+def get_template(source: str) -> Template:
+    """Compile the template once per process and reuse it afterwards."""
+    template = _compiled_templates.get(source)
+    if template is None:
+        template = env.from_string(source)
+        _compiled_templates[source] = template
+        template_stats["compilations"] += 1
+    else:
+        template_stats["hits"] += 1
+    return template
+
+
+def render_template(source: str, document) -> str:
+    return get_template(source).render(**document)
 
 SPLIT_VALUE = "{context}"
+DIALOG_LENGTH = 500
+# placeholders of media in the prompts of ruTiE tasks
+MEDIA_TAGS = ("<image>", "<audio>")
+# dialogs whose rendered fragments are kept, the least recently used one is dropped first
+FRAGMENT_CACHE_DIALOGS = 4
+
+logger = logging.getLogger(__name__)
 
 
 class ruTiEContextFormer(ContextSampler):
@@ -55,20 +85,127 @@ class ruTiEContextFormer(ContextSampler):
     was => test_doc instruction: "prompt_details1 - context - sample_data - prompt_details2"
     become => [{"prompt_details1 - fewshot_data1"}, {"fewshot_target1"},
     {"fewshot_data2"}, {"fewshot_target2"}, {"sample_data - prompt_details2"}]
+
+    Prefix caching: the rendered fragment of every previous doc is cached by
+    (template, dialog_id, question_id), so consecutive questions of a dialog get a
+    byte-identical history prefix and servers with prefix / KV caching can reuse it.
+    Fragments are kept for the FRAGMENT_CACHE_DIALOGS most recent dialogs only and
+    dropped once the last question of a dialog is formed.
+    With a history window (num_fewshot < question_id) the window normally slides by
+    one doc per question, which changes the prefix every time. Setting
+    `history_block: K` in fewshot_config (or RUTIE_HISTORY_BLOCK=K) moves the start
+    of the window in steps of K docs instead, so the prefix stays the same for K
+    questions in a row; the history never exceeds num_fewshot docs.
+
+    Media window: by default every previous doc of the history carries its image /
+    audio, so the last questions of a dialog send hundreds of media items.
+    `media_window: M` in fewshot_config (or RUTIE_MEDIA_WINDOW=M) attaches media of
+    the last M previous docs only (the window moves in history_block steps too);
+    older docs stay in the history as text with the media tags removed.
     """
 
-    def sample(self, n, doc):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fewshot_config = self.config.fewshot_config or {}
+        self.history_block = max(int(fewshot_config.get("history_block", os.getenv("RUTIE_HISTORY_BLOCK", "1"))), 1)
+        media_window = fewshot_config.get("media_window", os.getenv("RUTIE_MEDIA_WINDOW"))
+        self.media_window = int(media_window) if media_window not in (None, "") else None
+
+        # dialog_id -> {(template, question_id, with_media): fragment}
+        self._fragments: "collections.OrderedDict[int, Dict[Tuple[str, int, bool], str]]" = collections.OrderedDict()
+        # dialog_id -> (window start, previous prompt prefix)
+        self._last_prefix: Dict[int, Tuple[int, str]] = {}
+        self.reused_prefix_chars = 0
+        self.total_prefix_chars = 0
+
+    def _window_start(self, n, doc) -> Tuple[int, int]:
         # id that tells how many previous samples to add as fewshots
         sample_id = doc["meta"]["question_id"]
         dialog_id = doc["meta"]["dialog_id"]
 
         # the dialogs are already sorted by process_docs, need to pick only the required samples
-        start_idx = dialog_id * 500
+        start_idx = dialog_id * DIALOG_LENGTH
         end_idx = start_idx + sample_id
+        window_start = self._snap_to_block(max(start_idx, end_idx - n), start_idx, end_idx)
+        return window_start, end_idx
+
+    def _snap_to_block(self, idx, start_idx, end_idx) -> int:
+        if self.history_block > 1 and idx > start_idx:
+            # round up to the block boundary: the window shrinks instead of exceeding its size
+            offset = idx - start_idx
+            idx = min(start_idx + -(-offset // self.history_block) * self.history_block, end_idx)
+        return idx
+
+    def _media_start(self, n, doc) -> int:
+        """Position in the dialog from which previous docs are sent with their media."""
+        window_start, end_idx = self._window_start(n, doc)
+        if self.media_window is None:
+            return window_start
+        start_idx = doc["meta"]["dialog_id"] * DIALOG_LENGTH
+        return max(window_start, self._snap_to_block(max(start_idx, end_idx - self.media_window), start_idx, end_idx))
+
+    @staticmethod
+    def _with_media(document, media_start) -> bool:
+        return document["meta"]["dialog_id"] * DIALOG_LENGTH + document["meta"]["question_id"] >= media_start
+
+    @staticmethod
+    def _strip_media_tags(text: str) -> str:
+        for tag in MEDIA_TAGS:
+            text = text.replace(tag, "")
+        return text
+
+    def sample(self, n, doc):
+        window_start, end_idx = self._window_start(n, doc)
         # choose only docs from the same dialog and assure they have q_id < doc[q_id]
-        samples = self.docs[max(start_idx, end_idx - n):end_idx]
+        samples = self.docs[window_start:end_idx]
         return samples
 
+    def _fragment(self, template: str, document, with_media: bool = True) -> str:
+        """Rendered template for a previous doc, computed once per dialog position."""
+        dialog_id = document["meta"]["dialog_id"]
+        fragments = self._fragments.get(dialog_id)
+        if fragments is None:
+            fragments = self._fragments[dialog_id] = {}
+            while len(self._fragments) > FRAGMENT_CACHE_DIALOGS:
+                self._fragments.popitem(last=False)
+        else:
+            self._fragments.move_to_end(dialog_id)
+
+        key = (template, document["meta"]["question_id"], with_media)
+        fragment = fragments.get(key)
+        if fragment is None:
+            fragment = render_template(template, document)
+            if not with_media:
+                fragment = self._strip_media_tags(fragment)
+            fragments[key] = fragment
+        return fragment
+
+    def _record_prefix(self, doc, num_fewshot, prefix: str) -> None:
+        """Count how much of the history prefix repeats the one sent for the previous question."""
+        dialog_id = doc["meta"]["dialog_id"]
+        window_start, _ = self._window_start(num_fewshot, doc)
+
+        previous = self._last_prefix.get(dialog_id)
+        if previous is not None and previous[0] == window_start and prefix.startswith(previous[1]):
+            self.reused_prefix_chars += len(previous[1])
+        self.total_prefix_chars += len(prefix)
+        self._last_prefix[dialog_id] = (window_start, prefix)
+
+        if doc["meta"]["question_id"] == DIALOG_LENGTH - 1:
+            del self._last_prefix[dialog_id]
+            self._fragments.pop(dialog_id, None)
+            logger.info(
+                f"ruTiE dialog {dialog_id} done, reused prefix ratio so far: {self.reused_prefix_ratio:.3f}, "
+                f"jinja templates: {template_stats}"
+            )
+
+    @property
+    def reused_prefix_ratio(self) -> float:
+        """Share of history characters that repeat the prefix of the previous question of the dialog."""
+        if self.total_prefix_chars == 0:
+            return 0.0
+        return self.reused_prefix_chars / self.total_prefix_chars
+
     def get_context(self, doc, num_fewshot, gen_prefix: str = None):
         multimodal_args = {}
         # draw `n_samples` docs from fewshot_docs
@@ -78,9 +215,6 @@ class ruTiEContextFormer(ContextSampler):
         no_instruction_template = self.config.fewshot_config.get(
             "doc_to_text_without_instruction", self.config.doc_to_text
         )
-        # make fillable env beforehand
-        no_instruction_env = env.from_string(no_instruction_template)
-
         # split the instruction of the test question into two parts:
         # 1. part that contains some info and context tag only
         # 2. part that contains the question itself and all other tags (question, choice, etc.)
@@ -92,12 +226,16 @@ class ruTiEContextFormer(ContextSampler):
             # the first fewshot should include the first part of the test question instruction
             # it is the imitation of placing all fewshots inside <context> tag of doc instruction
             labeled_examples = []
+            media_start = self._media_start(num_fewshot, doc)
             for idx, document in enumerate(fewshotex):
+                with_media = self._with_media(document, media_start)
+                fragment = self._fragment(no_instruction_template, document, with_media)
                 if idx == 0:
-                    labeled_examples.append(first_part + no_instruction_env.render(**document))
+                    labeled_examples.append(first_part + fragment)
                 else:
-                    labeled_examples.append(no_instruction_env(**document))
-                multimodal_args = self.update_multimodal_args(multimodal_args, document)
+                    labeled_examples.append(fragment)
+                if with_media:
+                    multimodal_args = self.update_multimodal_args(multimodal_args, document)
 
         if len(fewshotex) != 0:
             # the first part is already at the beginning of user prompt
@@ -111,6 +249,7 @@ class ruTiEContextFormer(ContextSampler):
         labeled_examples = (
             self.fewshot_delimiter.join(labeled_examples) + self.fewshot_delimiter
         )
+        self._record_prefix(doc, num_fewshot, labeled_examples)
 
         return labeled_examples, multimodal_args
 
@@ -130,15 +269,8 @@ class ruTiEContextFormer(ContextSampler):
         fewshotex = self.sample(num_fewshot, doc)
 
         # Load extra templates from config parameters
-        no_instruction_template = self.config.fewshot_config.get(
-            "doc_to_text_without_target", self.config.doc_to_text
-        )
         only_target_template = self.config.doc_to_target
 
-        # make fillable envs beforehand
-        no_instruction_env = env.from_string(no_instruction_template)
-        only_target_env = env.from_string(only_target_template)
-
         if not fewshot_as_multiturn:
             # get fewshot context as one user turn
             labeled_examples, multimodal_args = self.get_context(doc, num_fewshot)
@@ -169,9 +301,14 @@ class ruTiEContextFormer(ContextSampler):
 
         else:
             if doc["meta"]["question_id"] > 0:
+                history_text = []
+                media_start = self._media_start(num_fewshot, doc)
                 for document in fewshotex:
+                    with_media = self._with_media(document, media_start)
                     processed_doc = document["instruction"]
-                    processed_target = only_target_env.render(**document)
+                    if not with_media:
+                        processed_doc = self._strip_media_tags(processed_doc)
+                    processed_target = self._fragment(only_target_template, document)
 
                     if pass_multimodal_args_to_chat_history:
                         user_content = [
@@ -186,11 +323,13 @@ class ruTiEContextFormer(ContextSampler):
                                 "text": processed_target,
                             },
                         ]
-                        user_content = self.update_user_content(user_content, document)
+                        if with_media:
+                            user_content = self.update_user_content(user_content, document)
                     else:
                         user_content = processed_doc
                         assistant_content = processed_target
-                        multimodal_args = self.update_multimodal_args(multimodal_args, document)
+                        if with_media:
+                            multimodal_args = self.update_multimodal_args(multimodal_args, document)
 
                     chat_history.extend(
                         [
@@ -204,5 +343,7 @@ class ruTiEContextFormer(ContextSampler):
                             },
                         ]
                     )
+                    history_text.extend([processed_doc, processed_target])
+                self._record_prefix(doc, num_fewshot, "".join(history_text))
 
         return chat_history, multimodal_args
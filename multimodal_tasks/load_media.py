@@ -5,28 +5,145 @@ import soundfile as sf
 from PIL import Image
 import pathlib
 import hashlib
+import json
+import atexit
+import collections
+import dataclasses
+import concurrent.futures
+import contextlib
+import fractions
+import logging
+import threading
+import weakref
 
-from typing import Optional
+import numpy as np
+import pyarrow as pa
+
+from typing import Callable, Deque, Dict, List, Mapping, Optional, Sequence, Tuple
 
 from lm_eval.models.utils import resize_image
 
-load_bytes = os.getenv("LOAD_BYTES") == "1"
-load_base64 = os.getenv("LOAD_BASE64") == "1"
-load_object = os.getenv("LOAD_OBJECT") == "1"
-load_files = os.getenv("LOAD_FILES") == "1"
+from media_cache import MediaCache
 
-loading_mode = None
+logger = logging.getLogger(__name__)
 
-if int(load_bytes) + int(load_base64) + int(load_object) + int(load_files) > 1:
-    raise ValueError("The error occurs because the type of media to load is ambiguous. " \
-                     "You must specify exactly one flag from (LOAD_BYTES, LOAD_BASE64, " \
-                     "LOAD_OBJECT) set to '1'. All other flags must be either unset or " \
-                     "have a value different from '1'.")
+def _env_flag(env, name: str) -> bool:
+    return env.get(name) == "1"
 
 
-def _resolve_media_root() -> pathlib.Path:
-    explicit_lm_eval_media_dir  = os.getenv("LM_EVAL_MEDIA_DIR")
-    hf_home = os.getenv("HF_HOME")
+def _env_int(env, name: str) -> Optional[int]:
+    value = env.get(name)
+    return int(value) if value and value.isdigit() else None
+
+
+@dataclasses.dataclass(frozen=True)
+class MediaConfig:
+    """
+    Media loading settings resolved from the environment once, at import.
+
+    Loaders run for every sample of every task, so they read this object instead
+    of parsing environment variables on each call. Call `reload_media_config()`
+    after changing the environment (e.g. in tests) to pick up new values.
+    """
+
+    load_bytes: bool = False
+    load_base64: bool = False
+    load_object: bool = False
+    load_files: bool = False
+    # return LazyMedia handles instead of loaded media (combines with any of the flags above)
+    load_lazy: bool = False
+
+    media_root: pathlib.Path = pathlib.Path.home() / ".cache" / "huggingface" / "lm_eval_media"
+
+    # opt-in parallel media preparation, see _MediaPrefetcher
+    preprocess_workers: int = 0
+    preprocess_executor: str = "thread"
+    prefetch_depth: int = 32
+
+    media_cache_enabled: bool = False
+    media_cache_max_bytes: int = 10 * 1024 ** 3
+
+    resize_images: bool = False
+    image_width: Optional[int] = None
+    image_height: Optional[int] = None
+    image_max_side: Optional[int] = None
+    image_format: Optional[str] = None
+    image_quality: int = 90
+
+    max_payload_bytes: Optional[int] = None
+    payload_log: Optional[str] = None
+
+    video_transcode: bool = False
+    video_max_side: Optional[int] = None
+    video_fps: Optional[float] = None
+    video_num_frames: Optional[int] = None
+    video_crf: int = 28
+
+    @property
+    def serialized(self) -> bool:
+        """Media are handed over as bytes, base64 or files rather than Python objects."""
+        return self.load_bytes or self.load_base64 or self.load_files
+
+    @property
+    def resize_dims(self) -> Tuple[Optional[int], Optional[int], Optional[int]]:
+        return self.image_width, self.image_height, self.image_max_side
+
+    @classmethod
+    def from_env(cls, env: Optional[Mapping[str, str]] = None) -> "MediaConfig":
+        env = os.environ if env is None else env
+        # 0 is a valid CRF (lossless), only an unset value falls back to the default
+        video_crf = _env_int(env, "VIDEO_CRF")
+
+        config = cls(
+            load_bytes=_env_flag(env, "LOAD_BYTES"),
+            load_base64=_env_flag(env, "LOAD_BASE64"),
+            load_object=_env_flag(env, "LOAD_OBJECT"),
+            load_files=_env_flag(env, "LOAD_FILES"),
+            load_lazy=_env_flag(env, "LOAD_LAZY"),
+            media_root=_media_root_from_env(env),
+            preprocess_workers=int(env.get("MEDIA_PREPROCESS_WORKERS", "0")),
+            preprocess_executor=env.get("MEDIA_PREPROCESS_EXECUTOR", "thread").lower(),
+            prefetch_depth=int(env.get("MEDIA_PREFETCH_DEPTH", "32")),
+            media_cache_enabled=_env_flag(env, "LM_EVAL_MEDIA_CACHE"),
+            media_cache_max_bytes=int(env.get("LM_EVAL_MEDIA_CACHE_MAX_BYTES", str(10 * 1024 ** 3))),
+            resize_images=env.get("HARNESS_RESIZE_IMAGES", "false").lower() in ("1", "true", "yes"),
+            image_width=_env_int(env, "INPUT_IMAGE_WIDTH"),
+            image_height=_env_int(env, "INPUT_IMAGE_HEIGHT"),
+            image_max_side=_env_int(env, "INPUT_IMAGE_MAX_SIDE"),
+            image_format=_image_format_from_env(env.get("INPUT_IMAGE_FORMAT", "")),
+            image_quality=int(env.get("INPUT_IMAGE_QUALITY", "90")),
+            max_payload_bytes=_env_int(env, "MEDIA_MAX_PAYLOAD_BYTES"),
+            payload_log=env.get("MEDIA_PAYLOAD_LOG") or None,
+            video_transcode=_env_flag(env, "VIDEO_TRANSCODE"),
+            video_max_side=_env_int(env, "VIDEO_MAX_SIDE"),
+            video_fps=float(env["VIDEO_FPS"]) if env.get("VIDEO_FPS") else None,
+            video_num_frames=_env_int(env, "VIDEO_NUM_FRAMES"),
+            video_crf=28 if video_crf is None else video_crf,
+        )
+        config.validate()
+        return config
+
+    def validate(self) -> None:
+        if int(self.load_bytes) + int(self.load_base64) + int(self.load_object) + int(self.load_files) > 1:
+            raise ValueError("The error occurs because the type of media to load is ambiguous. " \
+                             "You must specify exactly one flag from (LOAD_BYTES, LOAD_BASE64, " \
+                             "LOAD_OBJECT) set to '1'. All other flags must be either unset or " \
+                             "have a value different from '1'.")
+
+        if self.load_lazy:
+            # the harness models take media from doc_to_* as is and do not call resolve_media,
+            # so they would get LazyMedia handles instead of images / audios / videos
+            raise ValueError("LOAD_LAZY=1 is not supported yet: the model adapters of the harness do not " \
+                             "materialize LazyMedia handles (load_media.resolve_media / materialized_media). " \
+                             "Unset LOAD_LAZY or set it to a value different from '1'.")
+
+        if self.preprocess_executor not in ("thread", "process"):
+            raise ValueError(f"MEDIA_PREPROCESS_EXECUTOR must be 'thread' or 'process', got '{self.preprocess_executor}'.")
+
+
+def _media_root_from_env(env) -> pathlib.Path:
+    explicit_lm_eval_media_dir  = env.get("LM_EVAL_MEDIA_DIR")
+    hf_home = env.get("HF_HOME")
 
     if explicit_lm_eval_media_dir:
         root = pathlib.Path(explicit_lm_eval_media_dir)
@@ -35,114 +152,1010 @@ def _resolve_media_root() -> pathlib.Path:
     else:
         root = pathlib.Path.home() / ".cache" / "huggingface"
 
-    media_root = root / "lm_eval_media"
-    media_root.mkdir(parents=True, exist_ok=True)
-    return media_root
+    return root / "lm_eval_media"
+
+
+def _image_format_from_env(value: str) -> Optional[str]:
+    value = value.upper()
+    if not value:
+        return None
+    return "JPEG" if value == "JPG" else value
+
+
+media_config = MediaConfig.from_env()
+
+_created_dirs = set()
+_created_dirs_lock = threading.Lock()
+
+
+def _ensure_dir(path: pathlib.Path) -> pathlib.Path:
+    """mkdir once per process instead of once per saved file."""
+    if path not in _created_dirs:
+        path.mkdir(parents=True, exist_ok=True)
+        with _created_dirs_lock:
+            _created_dirs.add(path)
+    return path
+
+
+def _resolve_media_root() -> pathlib.Path:
+    return _ensure_dir(media_config.media_root)
 
 
 def _hash_bytes(b: bytes) -> str:
+    """
+    sha256 of the media bytes. Callers that already know the digest of the bytes they
+    save (e.g. a video passed through untouched) hand it to _save_bytes_to_disk, so
+    large payloads are hashed once without keeping them referenced anywhere.
+    """
     return hashlib.sha256(b).hexdigest()
 
 
+_media_cache: Optional[MediaCache] = None
+_media_cache_lock = threading.Lock()
+
+
+def _get_media_cache(force: bool = False) -> Optional[MediaCache]:
+    global _media_cache
+    if not (media_config.media_cache_enabled or force):
+        return None
+    with _media_cache_lock:
+        if _media_cache is None:
+            _media_cache = MediaCache(_resolve_media_root() / "cache", max_bytes=media_config.media_cache_max_bytes)
+            atexit.register(_log_media_cache_stats)
+    return _media_cache
+
+
+def media_cache_stats() -> Optional[dict]:
+    """Hit/miss/eviction counters of the persistent media cache (None if it is disabled)."""
+    if _media_cache is None:
+        return None
+    return _media_cache.stats()
+
+
+def _log_media_cache_stats():
+    logger.info(f"Media cache stats: {media_cache_stats()}")
+
+
+def _cached_artifact(source_digest: str, params: dict, build: Callable[[], bytes], force: bool = False) -> bytes:
+    """
+    Return the artifact produced by `build` for the given source, going through the
+    persistent media cache when it is enabled (LM_EVAL_MEDIA_CACHE=1) or `force`d
+    for transformations too expensive to repeat.
+    """
+    cache = _get_media_cache(force)
+    if cache is None:
+        return build()
+    key = cache.make_key(source_digest, **params)
+    return cache.get_or_create(key, build)
+
+
+class LazyMedia:
+    """
+    Deferred result of get_image / get_audio / get_video.
+
+    The handle keeps a reference to the raw dataset sample only. The bytes / base64 /
+    PIL object that the eager loader would return is produced by `materialize()` when
+    the model adapter actually consumes the request, and dropped again by `release()`,
+    so peak memory follows the in-flight batch instead of the whole split.
+    """
+
+    __slots__ = ("kind", "_source", "_loader", "_value", "_future", "_claimed", "_lock")
+
+    def __init__(self, kind: str, source, loader: Callable):
+        self.kind = kind
+        self._source = source
+        self._loader = loader
+        self._value = None
+        self._future: Optional[concurrent.futures.Future] = None
+        # set once the consumer has materialized or released the handle, the
+        # prefetcher never submits such handles
+        self._claimed = False
+        # guards _claimed and _future: the prefetcher checks one and sets the other
+        # while the consumer may be claiming the handle from another thread
+        self._lock = threading.Lock()
+
+    @property
+    def is_materialized(self) -> bool:
+        return self._value is not None
+
+    def _claim(self) -> Optional[concurrent.futures.Future]:
+        """Mark the handle as taken by the consumer and take its prefetch future, if any."""
+        with self._lock:
+            self._claimed = True
+            future, self._future = self._future, None
+        return future
+
+    def materialize(self):
+        future = self._claim()
+        if future is not None:
+            try:
+                self._value = future.result()
+            finally:
+                # whoever takes the future frees its slot, whether it succeeded or not
+                _prefetcher.consumed()
+        elif self._value is None:
+            self._value = self._loader(self._source)
+        return self._value
+
+    def release(self) -> None:
+        future = self._claim()
+        self._value = None
+        if future is not None:
+            # prefetched but never consumed: drop the result and free its slot
+            future.cancel()
+            _prefetcher.consumed()
+
+    def __repr__(self) -> str:
+        state = "materialized" if self.is_materialized else "lazy"
+        return f"LazyMedia(kind={self.kind!r}, {state})"
+
+
+class _MediaPrefetcher:
+    """
+    Background preparation of LazyMedia handles on a thread or process pool.
+
+    lm-eval calls doc_to_* hooks for the documents in order, so handles are
+    registered in document order. At most `depth` handles are transformed ahead
+    of consumption: every handle that is materialized frees a slot and the next
+    registered handle is submitted to the pool. This keeps all cores busy with
+    decode / resize / encode work while bounding the memory held by results
+    nobody has asked for yet.
+    """
+
+    def __init__(self, workers: int, executor: str, depth: int):
+        self.workers = workers
+        self.executor_kind = executor
+        self.depth = max(depth, 1)
+
+        self._executor: Optional[concurrent.futures.Executor] = None
+        self._pending: Deque[LazyMedia] = collections.deque()
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    def _get_executor(self) -> concurrent.futures.Executor:
+        if self._executor is None:
+            if self.executor_kind == "process":
+                self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="load_media"
+                )
+            atexit.register(self._executor.shutdown, wait=False, cancel_futures=True)
+        return self._executor
+
+    def register(self, handle: LazyMedia) -> None:
+        # video decoders are not picklable, they are prepared in-process on demand
+        if self.executor_kind == "process" and handle.kind == "video":
+            return
+        with self._lock:
+            self._pending.append(handle)
+            self._fill()
+
+    def consumed(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+            self._fill()
+
+    def _fill(self) -> None:
+        while self._in_flight < self.depth and self._pending:
+            handle = self._pending.popleft()
+            with handle._lock:
+                if handle._claimed:
+                    continue
+                handle._future = self._get_executor().submit(handle._loader, handle._source)
+            self._in_flight += 1
+
+
+def _make_prefetcher(config: MediaConfig) -> _MediaPrefetcher:
+    # eagerly loaded media are not prefetched, MEDIA_PREPROCESS_WORKERS then only sizes the pool of prepare_images
+    workers = config.preprocess_workers if config.load_lazy else 0
+    return _MediaPrefetcher(workers, config.preprocess_executor, config.prefetch_depth)
+
+
+_prefetcher = _make_prefetcher(media_config)
+
+
+def reload_media_config(env: Optional[Mapping[str, str]] = None) -> MediaConfig:
+    """
+    Re-read the media settings from `env` (os.environ by default) and reset the state
+    derived from them: the media cache, the prefetch pool and the created directories.
+    """
+    global media_config, _media_cache, _prefetcher
+
+    config = MediaConfig.from_env(env)
+    media_config = config
+    with _media_cache_lock:
+        _media_cache = None
+    with _created_dirs_lock:
+        _created_dirs.clear()
+    with _video_digests_lock:
+        _video_digests.clear()
+    if _prefetcher._executor is not None:
+        _prefetcher._executor.shutdown(wait=False, cancel_futures=True)
+    _prefetcher = _make_prefetcher(config)
+    return config
+
+
+def resolve_media(obj):
+    """
+    Replace every LazyMedia handle inside (possibly nested) lists, tuples and dicts
+    with its materialized value. Other objects are returned as is.
+    """
+    if isinstance(obj, LazyMedia):
+        return obj.materialize()
+    if isinstance(obj, list):
+        return [resolve_media(x) for x in obj]
+    if isinstance(obj, tuple):
+        return tuple(resolve_media(x) for x in obj)
+    if isinstance(obj, dict):
+        return {k: resolve_media(v) for k, v in obj.items()}
+    return obj
+
+
+def release_media(obj) -> None:
+    """Drop materialized values of every LazyMedia handle inside `obj`."""
+    if isinstance(obj, LazyMedia):
+        obj.release()
+    elif isinstance(obj, (list, tuple)):
+        for x in obj:
+            release_media(x)
+    elif isinstance(obj, dict):
+        for v in obj.values():
+            release_media(v)
+
+
+@contextlib.contextmanager
+def materialized_media(obj):
+    """
+    Materialize the handles inside `obj` for the duration of the block and release
+    them afterwards:
+
+        with materialized_media(visuals) as visuals:
+            model.generate(..., visuals)
+    """
+    try:
+        yield resolve_media(obj)
+    finally:
+        release_media(obj)
+
+
 def _save_bytes_to_disk(b: bytes, media_type: str, suggested_ext: Optional[str] = None,
-                        subdir: Optional[str] = None) -> str:
-    media_root = _resolve_media_root()
+                        subdir: Optional[str] = None, digest: Optional[str] = None) -> str:
+    """
+    Store the media under `<media root>/<subdir>/<digest[:2]>/<media_type>-<digest>.<ext>`.
+
+    Files are written to a temporary name and moved into place with os.replace, so
+    concurrent evaluation processes saving the same sample never see a partially
+    written file; the two-character shards keep directories small.
+    """
     sub = subdir or media_type
-    out_dir = media_root / sub
-    out_dir.mkdir(parents=True, exist_ok=True)
+    digest = digest or _hash_bytes(b)
+    out_dir = _ensure_dir(media_config.media_root / sub / digest[:2])
 
-    digest = _hash_bytes(b)
     ext = (suggested_ext or "").lstrip(".")
     filename = f"{media_type}-{digest}.{ext}" if ext else f"{media_type}-{digest}"
     out_path = out_dir / filename
 
     if not out_path.exists():
-        with open(out_path, "wb") as f:
-            f.write(b)
+        tmp_path = out_dir / f".{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(b)
+            os.replace(tmp_path, out_path)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                tmp_path.unlink()
+            raise
     return str(out_path.resolve())
 
 
-def get_audio(audio_json):
-    if load_bytes or load_base64 or load_files:
+def _payload_budget() -> Optional[int]:
+    """
+    MEDIA_MAX_PAYLOAD_BYTES: upper bound for one serialized media item (as sent, i.e.
+    after base64 in LOAD_BASE64 mode). Python objects (LOAD_OBJECT) are not limited.
+    """
+    if not media_config.serialized:
+        return None
+    return media_config.max_payload_bytes
+
+
+def _payload_size(n: int) -> int:
+    # base64 inflates every 3 bytes into 4 characters
+    return 4 * ((n + 2) // 3) if media_config.load_base64 else n
+
+
+def _log_payload_settings(kind: str, digest: str, settings: dict) -> None:
+    """Record the encoding picked to fit MEDIA_MAX_PAYLOAD_BYTES, so runs can be reproduced."""
+    record = {"kind": kind, "sha256": digest, **settings}
+    logger.info(f"Media payload settings: {record}")
+
+    log_path = media_config.payload_log
+    if log_path:
+        with _payload_log_lock, open(log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+_payload_log_lock = threading.Lock()
+
+
+def _payload_artifact(kind: str, digest: str, params: dict, build: Callable[[dict], bytes]) -> bytes:
+    """
+    _cached_artifact for payloads fitted into MEDIA_MAX_PAYLOAD_BYTES. `build` fills the
+    dict it gets with the encoding settings it picked; they are cached next to the
+    artifact, so MEDIA_PAYLOAD_LOG gets the record on cache hits as well.
+    """
+    settings: dict = {}
+    if params.get("budget") is None:
+        return _cached_artifact(digest, params, lambda: build(settings))
+
+    cache = _get_media_cache()
+    if cache is None:
+        out = build(settings)
+    else:
+        key = cache.make_key(digest, **params)
+        settings_key = cache.make_key(digest, **params, part="payload_settings")
+        out = cache.get(key)
+        stored = cache.get(settings_key) if out is not None else None
+        if stored is not None:
+            settings = json.loads(stored)
+        else:
+            # a miss, or the settings entry was evicted on its own
+            out = build(settings)
+            cache.put(key, out)
+            cache.put(settings_key, json.dumps(settings).encode("utf-8"))
+
+    if settings:
+        _log_payload_settings(kind, digest, settings)
+    return out
+
+AUDIO_MIME_TYPES = {"WAV": "audio/wav", "FLAC": "audio/flac", "OGG": "audio/ogg"}
+AUDIO_EXTENSIONS = {"WAV": "wav", "FLAC": "flac", "OGG": "ogg"}
+# (container, subtype, sampling rate, force mono) tried in order until the payload fits
+AUDIO_BUDGET_LADDER = (
+    ("FLAC", None, None, False),
+    ("FLAC", None, 16000, True),
+    ("OGG", "OPUS", 16000, True),
+    ("OGG", "VORBIS", 16000, True),
+)
+
+
+def _encode_audio(arr, sr, audio_format: str = "WAV", subtype: Optional[str] = None) -> bytes:
+    buffer = io.BytesIO()
+    sf.write(buffer, arr, sr, format=audio_format, subtype=subtype)
+    return buffer.getvalue()
+
+
+def _encode_wav(arr, sr) -> bytes:
+    return _encode_audio(arr, sr, "WAV")
+
+
+def _audio_format(b: bytes) -> str:
+    if b[:4] == b"fLaC":
+        return "FLAC"
+    if b[:4] == b"OggS":
+        return "OGG"
+    return "WAV"
+
+
+def _to_mono(arr):
+    arr = np.asarray(arr)
+    return arr.mean(axis=1) if arr.ndim > 1 else arr
+
+
+def _resample(arr, sr: int, target_sr: int):
+    if sr == target_sr:
+        return arr
+    try:
+        import librosa
+        return librosa.resample(np.asarray(arr, dtype=np.float32), orig_sr=sr, target_sr=target_sr)
+    except ImportError:
+        # linear interpolation keeps speech intelligible when librosa is not installed
+        n_out = int(round(len(arr) * target_sr / sr))
+        x_out = np.linspace(0, len(arr) - 1, n_out)
+        return np.interp(x_out, np.arange(len(arr)), arr).astype(np.float32)
+
+
+def _fit_audio_to_budget(arr, sr, budget: int) -> Tuple[bytes, dict]:
+    """Encode audio with the first AUDIO_BUDGET_LADDER step whose payload fits the budget."""
+    b = _encode_wav(arr, sr)
+    settings = {"format": "WAV", "subtype": None, "sampling_rate": sr, "mono": False}
+    if _payload_size(len(b)) <= budget:
+        return b, settings
+
+    for audio_format, subtype, target_sr, mono in AUDIO_BUDGET_LADDER:
+        x = _to_mono(arr) if mono else arr
+        x_sr = target_sr or sr
+        if target_sr:
+            x = _resample(x, sr, target_sr)
+        try:
+            candidate = _encode_audio(x, x_sr, audio_format, subtype)
+        except (RuntimeError, ValueError, TypeError) as e:
+            # old libsndfile builds have no OPUS support
+            logger.debug(f"Skipping {audio_format}/{subtype} audio encoding: {e}")
+            continue
+        if len(candidate) < len(b):
+            b = candidate
+            settings = {"format": audio_format, "subtype": subtype, "sampling_rate": x_sr, "mono": mono}
+        if _payload_size(len(b)) <= budget:
+            return b, settings
+
+    logger.warning(f"Audio payload of {_payload_size(len(b))} bytes exceeds MEDIA_MAX_PAYLOAD_BYTES={budget}.")
+    return b, {**settings, "over_budget": True}
+
+
+def _audio_digest(arr, sr) -> str:
+    arr = np.ascontiguousarray(arr)
+    h = hashlib.sha256(memoryview(arr).cast("B"))
+    h.update(f"{arr.dtype.str}:{arr.shape}:{sr}".encode("ascii"))
+    return h.hexdigest()
+
+
+def _load_audio(audio_json):
+    if media_config.serialized:
         arr = audio_json['array']
         sr = audio_json['sampling_rate']
 
-        buffer = io.BytesIO()
-        sf.write(buffer, arr, sr, format='WAV')
-        b = buffer.getvalue()
+        budget = _payload_budget()
+        digest = _audio_digest(arr, sr) if (media_config.media_cache_enabled or budget) else ""
 
-        if load_bytes:
+        def encode(settings: dict) -> bytes:
+            if budget is None:
+                return _encode_wav(arr, sr)
+            b, fitted = _fit_audio_to_budget(arr, sr, budget)
+            settings.update(fitted)
             return b
 
-        if load_files:
-            path = _save_bytes_to_disk(b, media_type="audio", suggested_ext="wav", subdir="audio")
-            return {"type": "audio", "audio": path}
+        params = {"kind": "audio", "budget": budget}
 
-        b64 = base64.b64encode(b).decode('ascii')
-        data_url = f"data:audio/wav;base64,{b64}"
-        return {"url": data_url}
+        if media_config.load_base64:
+            def build_url(settings: dict) -> bytes:
+                b = encode(settings)
+                b64 = base64.b64encode(b).decode('ascii')
+                return f"data:{AUDIO_MIME_TYPES[_audio_format(b)]};base64,{b64}".encode("ascii")
+
+            data_url = _payload_artifact("audio", digest, {**params, "mode": "base64"}, build_url)
+            return {"url": data_url.decode("ascii")}
+
+        b = _payload_artifact("audio", digest, {**params, "mode": "bytes"}, encode)
+
+        if media_config.load_bytes:
+            return b
+
+        ext = AUDIO_EXTENSIONS[_audio_format(b)]
+        path = _save_bytes_to_disk(b, media_type="audio", suggested_ext=ext, subdir="audio")
+        return {"type": "audio", "audio": path}
 
     return audio_json
 
 
-def resize_image_bytes(b):
-    stream = io.BytesIO(b)
-    image = Image.open(stream).convert("RGB")
+# formats that can be handed to models as is, without decoding and re-encoding
+PASSTHROUGH_IMAGE_FORMATS = ("PNG", "JPEG", "WEBP")
+PASSTHROUGH_IMAGE_MODES = ("RGB", "RGBA", "L", "LA", "P")
+IMAGE_EXTENSIONS = {"PNG": "png", "JPEG": "jpg", "WEBP": "webp", "GIF": "gif", "BMP": "bmp", "TIFF": "tiff"}
+IMAGE_MIME_TYPES = {
+    "PNG": "image/png",
+    "JPEG": "image/jpeg",
+    "WEBP": "image/webp",
+    "GIF": "image/gif",
+    "BMP": "image/bmp",
+    "TIFF": "image/tiff",
+}
+
+
+def _sniff_image(b) -> Image.Image:
+    """Open the image lazily: PIL reads the header (format, size, mode) but does not decode pixels."""
+    return Image.open(io.BytesIO(b))
+
+
+class MediaItem:
+    """
+    Encoded media sample with zero-copy access to the original bytes.
+
+    The bytes coming from the dataset are kept as is and exposed through `view`
+    (a memoryview, so slicing or hashing never copies them). For images, the PIL
+    object is opened lazily on first access to `image`, which parses the header
+    only, and `rgb()` decodes pixels once, converting them only when the mode is
+    not RGB already. All steps of _load_image share one MediaItem, so the sample
+    is decoded at most once whatever combination of resize / budget / LOAD_OBJECT
+    is enabled.
+    """
+
+    __slots__ = ("kind", "data", "_image", "_rgb")
+
+    def __init__(self, kind: str, data: bytes):
+        self.kind = kind
+        self.data = data
+        self._image: Optional[Image.Image] = None
+        self._rgb: Optional[Image.Image] = None
+
+    @property
+    def view(self) -> memoryview:
+        return memoryview(self.data)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    @property
+    def image(self) -> Image.Image:
+        if self._image is None:
+            # BytesIO shares the buffer of an immutable bytes object until it is written to
+            self._image = Image.open(io.BytesIO(self.data))
+        return self._image
+
+    @property
+    def format(self) -> Optional[str]:
+        return self.image.format
+
+    def rgb(self) -> Image.Image:
+        if self._rgb is None:
+            image = self.image
+            self._rgb = image if image.mode == "RGB" else image.convert("RGB")
+        return self._rgb
+
+    def __repr__(self) -> str:
+        return f"MediaItem(kind={self.kind!r}, {len(self.data)} bytes)"
+
+
+def _image_mime(image_format: Optional[str]) -> str:
+    return IMAGE_MIME_TYPES.get(image_format or "", "image/png")
+
+
+def _needs_resize(size: Tuple[int, int], width: Optional[int], height: Optional[int],
+                  max_side: Optional[int]) -> bool:
+    if width is None and height is None:
+        return max_side is not None and max(size) > max_side
+    if width is not None and height is not None:
+        return size != (width, height)
+    if width is not None:
+        return size[0] != width
+    return size[1] != height
 
-    w_env = os.getenv("INPUT_IMAGE_WIDTH")
-    h_env = os.getenv("INPUT_IMAGE_HEIGHT")
-    m_env = os.getenv("INPUT_IMAGE_MAX_SIDE")
 
-    width = int(w_env) if w_env and w_env.isdigit() else None
-    height = int(h_env) if h_env and h_env.isdigit() else None
-    max_side = int(m_env) if m_env and m_env.isdigit() else None
+def _target_image_format(source_format: Optional[str]) -> str:
+    """
+    Format for re-encoded images: INPUT_IMAGE_FORMAT (png / jpeg / webp) if set,
+    otherwise lossy sources stay lossy (JPEG, WEBP) and everything else becomes PNG.
+    """
+    if media_config.image_format:
+        return media_config.image_format
+    if source_format in ("JPEG", "WEBP"):
+        return source_format
+    return "PNG"
 
-    image = resize_image(
-        image,
+
+def _encode_image(image: Image.Image, image_format: str, quality: Optional[int] = None) -> bytes:
+    buffer = io.BytesIO()
+    if image_format in ("JPEG", "WEBP"):
+        quality = quality if quality is not None else media_config.image_quality
+        image.save(buffer, format=image_format, quality=quality)
+    else:
+        image.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def _resize_rgb(item: MediaItem) -> Image.Image:
+    width, height, max_side = media_config.resize_dims
+
+    return resize_image(
+        item.rgb(),
         width=width,
         height=height,
         max_dimension=max_side,
     )
 
-    buffer = io.BytesIO()
-    image.save(buffer, format="PNG")
-    b = buffer.getvalue()
-    return b
 
+def resize_image_bytes(b, image_format: Optional[str] = None):
+    item = b if isinstance(b, MediaItem) else MediaItem("image", b)
+    image_format = image_format or _target_image_format(item.format)
 
-def get_image(image_json):
-    b = image_json["bytes"]
+    return _encode_image(_resize_rgb(item), image_format)
+
+
+def _plan_image_transform(item: MediaItem) -> Tuple[Optional[str], Optional[dict]]:
+    """
+    Decide how HARNESS_RESIZE_IMAGES applies to the raw image bytes.
+
+    Returns the PIL format of the bytes to hand over and the re-encode parameters,
+    which are None when the original bytes can be passed through untouched. Only
+    the header is parsed: images that are already within the requested size and in
+    a web-friendly format and mode are neither decoded nor re-encoded.
+    """
+    header = item.image
+    if not media_config.resize_images:
+        return header.format, None
+
+    width, height, max_side = media_config.resize_dims
+    if (
+        not _needs_resize(header.size, width, height, max_side)
+        and header.format in PASSTHROUGH_IMAGE_FORMATS
+        and header.mode in PASSTHROUGH_IMAGE_MODES
+    ):
+        return header.format, None
+
+    image_format = _target_image_format(header.format)
+    params = {
+        "kind": "image",
+        "width": width,
+        "height": height,
+        "max_side": max_side,
+        "format": image_format,
+        "quality": str(media_config.image_quality),
+    }
+    return image_format, params
+
+
+IMAGE_BUDGET_QUALITIES = (90, 80, 70, 60, 50, 40)
+IMAGE_BUDGET_MIN_SIDE = 64
+
+
+def _fit_image_to_budget(b, budget: int) -> Tuple[bytes, dict]:
+    """
+    Re-encode the image so that its payload fits the budget: lower the quality of
+    the lossy format first, then downscale by 0.75 per step and try again.
+    """
+    item = b if isinstance(b, MediaItem) else MediaItem("image", b)
+    image = item.rgb()
+    # lossless sources are re-encoded as JPEG unless INPUT_IMAGE_FORMAT says otherwise
+    image_format = _target_image_format("JPEG")
+    qualities = IMAGE_BUDGET_QUALITIES if image_format in ("JPEG", "WEBP") else (None,)
+
+    best = item.data
+    settings = {"format": item.format, "quality": None, "size": list(image.size)}
+    while True:
+        for quality in qualities:
+            out = _encode_image(image, image_format, quality)
+            if len(out) < len(best):
+                best = out
+                settings = {"format": image_format, "quality": quality, "size": list(image.size)}
+            if _payload_size(len(out)) <= budget:
+                return best, settings
+
+        if min(image.size) <= IMAGE_BUDGET_MIN_SIDE:
+            break
+        image = image.resize((max(1, int(image.width * 0.75)), max(1, int(image.height * 0.75))), Image.BICUBIC)
+
+    logger.warning(f"Image payload of {_payload_size(len(best))} bytes exceeds MEDIA_MAX_PAYLOAD_BYTES={budget}.")
+    return best, {**settings, "over_budget": True}
+
+
+def _load_image(image_json):
+    item = MediaItem("image", image_json["bytes"])
+
+    image_format, params = _plan_image_transform(item)
+    resize = params is not None
+
+    if not media_config.serialized:
+        # Python objects are resized in memory, encoding them again would only lose quality.
+        # RGB images that need no resize are handed over without decoding or copying,
+        # pixels are read on first use
+        return _resize_rgb(item) if resize else item.rgb()
+
+    budget = _payload_budget()
+    if budget is not None and (resize or _payload_size(len(item)) > budget):
+        params = {**(params or {"kind": "image"}), "budget": budget}
+
+    if params is not None:
+        # only re-encoding does real decode/encode work worth caching
+        source = item
+        digest = _hash_bytes(source.data) if (media_config.media_cache_enabled or budget) else ""
 
-    do_resize = os.getenv("HARNESS_RESIZE_IMAGES", "false").lower() in ("1", "true", "yes")
-    if do_resize:
-        b = resize_image_bytes(b)
+        def transform(settings: dict) -> bytes:
+            out = resize_image_bytes(source, image_format) if resize else source.data
+            if budget is not None and _payload_size(len(out)) > budget:
+                out, fitted = _fit_image_to_budget(out if resize else source, budget)
+                settings.update(fitted)
+            return out
 
-    if load_bytes:
+        if media_config.load_base64:
+            def build_url(settings: dict) -> bytes:
+                out = transform(settings)
+                b64 = base64.b64encode(out).decode('ascii')
+                return f"data:{_image_mime(_sniff_image(out).format)};base64,{b64}".encode("ascii")
+
+            data_url = _payload_artifact("image", digest, {**params, "mode": "base64"}, build_url)
+            return {"url": data_url.decode("ascii")}
+
+        item = MediaItem("image", _payload_artifact("image", digest, {**params, "mode": "bytes"}, transform))
+        image_format = item.format
+
+    b = item.data
+    if media_config.load_bytes:
         return b
-    if load_base64:
+    if media_config.load_base64:
         b64 = base64.b64encode(b).decode('ascii')
-        data_url = f"data:image/png;base64,{b64}"
+        data_url = f"data:{_image_mime(image_format)};base64,{b64}"
         return {"url": data_url}
-    if load_files:
-        path = _save_bytes_to_disk(b, media_type="image", suggested_ext="png", subdir="images")
-        return {"type": "image", "image": path}
+    # LOAD_FILES
+    ext = IMAGE_EXTENSIONS.get(image_format or "", "png")
+    path = _save_bytes_to_disk(b, media_type="image", suggested_ext=ext, subdir="images")
+    return {"type": "image", "image": path}
 
-    stream = io.BytesIO(b)
-    img = Image.open(stream).convert("RGB")
 
-    return img
+# bump when docs_to_images changes its output, so datasets does not reuse old cache files
+PREPARE_IMAGES_VERSION = 1
+PREPARE_IMAGES_BATCH_SIZE = 64
 
 
-def get_video(video_reader):
+def _prepared_image_format(item: MediaItem) -> str:
+    # Python objects are built from the prepared bytes, keep them lossless
+    return _target_image_format(item.format) if media_config.serialized else "PNG"
+
+
+def _prepare_image(item: MediaItem) -> bytes:
+    return resize_image_bytes(item, _prepared_image_format(item))
+
+
+def _prepare_image_bytes(images: List[Optional[bytes]],
+                         executor: Optional[concurrent.futures.Executor] = None) -> List[Optional[bytes]]:
+    """
+    Resize a chunk of images for HARNESS_RESIZE_IMAGES. The images are grouped by
+    source size, mode and format, so the transform is planned once per group from the
+    header of its first image; groups that need no transform are left untouched and
+    the images of the others are resized in the executor.
+    """
+    groups: Dict[tuple, List[int]] = collections.defaultdict(list)
+    items: Dict[int, MediaItem] = {}
+    for i, b in enumerate(images):
+        if b is None:
+            continue
+        item = items[i] = MediaItem("image", b)
+        header = item.image
+        groups[header.size, header.mode, header.format].append(i)
+
+    out = list(images)
+    jobs = {}
+    for positions in groups.values():
+        _, params = _plan_image_transform(items[positions[0]])
+        if params is None:
+            continue
+        for i in positions:
+            jobs[i] = executor.submit(_prepare_image, items[i]) if executor else None
+    for i, job in jobs.items():
+        out[i] = job.result() if job is not None else _prepare_image(items[i])
+    return out
+
+
+def _replace_image_bytes(column: pa.StructArray, images: List[Optional[bytes]]) -> pa.StructArray:
+    fields = list(column.type)
+    children = [
+        pa.array(images, type=field.type) if field.name == "bytes" else child
+        for field, child in zip(fields, column.flatten())
+    ]
+    return pa.StructArray.from_arrays(children, fields=fields, mask=column.is_null())
+
+
+def docs_to_images(batch: pa.Table, keys: Sequence[str] = ("image",),
+                   executor: Optional[concurrent.futures.Executor] = None) -> pa.Table:
+    """
+    Batched counterpart of get_image for `datasets.Dataset.map(batched=True)` over an
+    arrow-formatted dataset: the images in the `keys` fields of `inputs` are resized
+    for HARNESS_RESIZE_IMAGES. Only the image columns are read, other fields keep their
+    arrow arrays.
+    """
+    inputs = batch.column("inputs").combine_chunks()
+    fields = list(inputs.type)
+    children = []
+    for field, child in zip(fields, inputs.flatten()):
+        if field.name in keys:
+            images = child.flatten()[child.type.get_field_index("bytes")].to_pylist()
+            child = _replace_image_bytes(child, _prepare_image_bytes(images, executor))
+        children.append(child)
+
+    new_inputs = pa.StructArray.from_arrays(children, fields=fields, mask=inputs.is_null())
+    return batch.set_column(batch.column_names.index("inputs"), "inputs", new_inputs)
+
+
+def prepare_images(dataset, keys: Sequence[str] = ("image",)):
+    """
+    Resize the images of a whole split ahead of evaluation, for the process_docs of
+    image tasks. Chunks of PREPARE_IMAGES_BATCH_SIZE docs go through docs_to_images
+    and the images of a chunk are resized in MEDIA_PREPROCESS_WORKERS threads (all
+    cores by default). The result is cached by datasets under a fingerprint of the
+    resize settings, and get_image later passes the prepared images through reading
+    only their headers.
+
+    Does nothing unless HARNESS_RESIZE_IMAGES is on.
+    """
+    if not media_config.resize_images:
+        return dataset
+
+    settings = {
+        "version": PREPARE_IMAGES_VERSION,
+        "keys": list(keys),
+        "dims": list(media_config.resize_dims),
+        "format": media_config.image_format,
+        "quality": media_config.image_quality,
+        "serialized": media_config.serialized,
+    }
+    settings_digest = _hash_bytes(json.dumps(settings, sort_keys=True).encode("utf-8"))[:16]
+
+    workers = media_config.preprocess_workers or os.cpu_count() or 1
+    with concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="prepare-images") as executor:
+        prepared = dataset.with_format("arrow").map(
+            docs_to_images,
+            batched=True,
+            batch_size=PREPARE_IMAGES_BATCH_SIZE,
+            fn_kwargs={"keys": tuple(keys), "executor": executor},
+            features=dataset.features,
+            new_fingerprint=f"{dataset._fingerprint}-images-{settings_digest}",
+            desc="Resizing images",
+        )
+    return prepared.with_format(
+        dataset.format["type"],
+        columns=dataset.format["columns"],
+        output_all_columns=dataset.format["output_all_columns"],
+        **dataset.format["format_kwargs"],
+    )
+
+
+def _video_transcode_params() -> Optional[dict]:
+    """
+    VIDEO_TRANSCODE=1 shrinks videos before they are sent to the model:
+      - VIDEO_MAX_SIDE: downscale so that the longer side is at most this many pixels
+      - VIDEO_FPS: drop frames down to this frame rate
+      - VIDEO_NUM_FRAMES: keep only this many frames sampled uniformly over the video
+      - VIDEO_CRF: H.264 constant rate factor of the re-encoded video (default 28)
+    """
+    if not media_config.video_transcode:
+        return None
+    return {
+        "kind": "video",
+        "max_side": media_config.video_max_side,
+        "fps": media_config.video_fps,
+        "num_frames": media_config.video_num_frames,
+        "crf": media_config.video_crf,
+    }
+
+
+def _even_video_size(width: int, height: int, max_side: Optional[int]) -> Tuple[int, int]:
+    if max_side and max(width, height) > max_side:
+        scale = max_side / max(width, height)
+        width, height = width * scale, height * scale
+    # yuv420p needs even dimensions
+    return max(2, int(width) // 2 * 2), max(2, int(height) // 2 * 2)
+
+
+def transcode_video_bytes(b, max_side: Optional[int] = None, fps: Optional[float] = None,
+                          num_frames: Optional[int] = None, crf: int = 28) -> bytes:
+    """
+    Re-encode a video into a small H.264 mp4: downscale it, drop frames to `fps` or
+    keep `num_frames` uniformly sampled frames. The original timestamps are kept, so
+    model-side samplers that rely on duration / fps still see the same timeline.
+    """
+    import av
+
+    out_buffer = io.BytesIO()
+    with av.open(io.BytesIO(b)) as src, av.open(out_buffer, mode="w", format="mp4") as dst:
+        in_stream = src.streams.video[0]
+        in_stream.thread_type = "AUTO"
+
+        duration = None
+        if in_stream.duration is not None and in_stream.time_base is not None:
+            duration = float(in_stream.duration * in_stream.time_base)
+        elif src.duration is not None:
+            duration = src.duration / av.time_base
+
+        if num_frames and duration:
+            targets = [(i + 0.5) * duration / num_frames for i in range(num_frames)]
+            rate = fractions.Fraction(num_frames / duration).limit_denominator(1000)
+        elif fps:
+            targets = None
+            rate = fractions.Fraction(fps).limit_denominator(1000)
+        else:
+            targets = None
+            rate = in_stream.average_rate or 25
+
+        width, height = _even_video_size(in_stream.codec_context.width, in_stream.codec_context.height, max_side)
+        out_stream = dst.add_stream("libx264", rate=rate)
+        out_stream.width = width
+        out_stream.height = height
+        out_stream.pix_fmt = "yuv420p"
+        out_stream.options = {"crf": str(crf), "preset": "veryfast"}
+        out_stream.codec_context.time_base = fractions.Fraction(1, 1000)
+
+        next_time = 0.0
+        last_pts = -1
+        for frame in src.decode(in_stream):
+            if frame.time is None:
+                continue
+            if targets is not None:
+                if not targets or frame.time < targets[0]:
+                    continue
+                while targets and frame.time >= targets[0]:
+                    targets.pop(0)
+            elif fps:
+                if frame.time < next_time:
+                    continue
+                next_time = frame.time + 1.0 / fps
+
+            out_frame = frame.reformat(width=width, height=height, format="yuv420p")
+            out_frame.pts = max(int(round(frame.time * 1000)), last_pts + 1)
+            out_frame.time_base = fractions.Fraction(1, 1000)
+            last_pts = out_frame.pts
+            for packet in out_stream.encode(out_frame):
+                dst.mux(packet)
+
+        for packet in out_stream.encode():
+            dst.mux(packet)
+
+    return out_buffer.getvalue()
+
+
+# video decoder -> {"source" or transcode params: sha256 of the bytes saved for it}. The
+# decoders of a split live as long as its docs, so every video is hashed once per
+# process however many requests or few-shot contexts it appears in.
+_video_digests: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_video_digests_lock = threading.Lock()
+
+
+def _video_digest(video_reader, key: str, b: bytes) -> str:
+    try:
+        with _video_digests_lock:
+            digests = _video_digests.setdefault(video_reader, {})
+    except TypeError:
+        # decoders that cannot be weakly referenced are hashed on every call
+        return _hash_bytes(b)
+    digest = digests.get(key)
+    if digest is None:
+        digest = digests[key] = _hash_bytes(b)
+    return digest
+
+
+def _load_video(video_reader):
     b = video_reader._hf_encoded["bytes"]
+    # digest of the bytes to save in LOAD_FILES mode
+    digest_key = "source"
+
+    params = _video_transcode_params()
+    if params is not None and media_config.serialized:
+        source = b
+        source_digest = _video_digest(video_reader, "source", source)
+        settings = {k: v for k, v in params.items() if k != "kind"}
+        try:
+            # decoding a whole video is expensive, transcodes are always kept on disk
+            b = _cached_artifact(source_digest, params, lambda: transcode_video_bytes(source, **settings), force=True)
+            digest_key = json.dumps(params, sort_keys=True)
+        except Exception as e:
+            logger.warning(f"Could not transcode video, passing the original one: {e}")
+            b = source
 
-    if load_bytes:
+    if media_config.load_bytes:
         return b
-    if load_base64:
+    if media_config.load_base64:
         b64 = base64.b64encode(b).decode("ascii")
         return {"url": f"data:video/mp4;base64,{b64}"}
-    if load_files:
-        path = _save_bytes_to_disk(b, media_type="video", suggested_ext="mp4", subdir="videos")
+    if media_config.load_files:
+        digest = _video_digest(video_reader, digest_key, b)
+        path = _save_bytes_to_disk(b, media_type="video", suggested_ext="mp4", subdir="videos", digest=digest)
         return {"type": "video", "video": path}
 
     return video_reader
+
+
+def _lazy(kind: str, source, loader: Callable) -> LazyMedia:
+    handle = LazyMedia(kind, source, loader)
+    if _prefetcher.enabled:
+        _prefetcher.register(handle)
+    return handle
+
+
+def get_audio(audio_json):
+    if media_config.load_lazy:
+        return _lazy("audio", audio_json, _load_audio)
+    return _load_audio(audio_json)
+
+
+def get_image(image_json):
+    if media_config.load_lazy:
+        return _lazy("image", image_json, _load_image)
+    return _load_image(image_json)
+
+
+def get_video(video_reader):
+    if media_config.load_lazy:
+        return _lazy("video", video_reader, _load_video)
+    return _load_video(video_reader)
@@ -0,0 +1,128 @@
+import os
+import json
+import hashlib
+import pathlib
+import threading
+
+from typing import Callable, Dict, Optional
+
+
+class MediaCache:
+    """
+    Content-addressed on-disk store for transformed media artifacts.
+
+    Entries are keyed by the sha256 of the source bytes plus the parameters of the
+    transformation, so the same sample evaluated against many models (or rerun after
+    a crash) reuses resized images, encoded WAVs and data URLs instead of redoing the
+    decode/encode work. The total size is capped; when the cap is exceeded the least
+    recently used entries (by mtime, which is bumped on every hit) are removed.
+    """
+
+    def __init__(self, root: pathlib.Path, max_bytes: int):
+        self.root = pathlib.Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._total_bytes: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(digest: str, **params) -> str:
+        payload = json.dumps(params, sort_keys=True, default=str)
+        return hashlib.sha256(f"{digest}:{payload}".encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> pathlib.Path:
+        return self.root / key[:2] / key
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        try:
+            # mark the entry as recently used for LRU eviction
+            os.utime(path)
+        except OSError:
+            pass
+
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        tmp_path = path.with_name(f".{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = self._scan_total_bytes()
+            else:
+                self._total_bytes += len(data)
+            over_budget = self._total_bytes > self.max_bytes
+
+        if over_budget:
+            self._evict()
+
+    def get_or_create(self, key: str, factory: Callable[[], bytes]) -> bytes:
+        data = self.get(key)
+        if data is None:
+            data = factory()
+            self.put(key, data)
+        return data
+
+    def _entries(self):
+        for path in self.root.glob("*/*"):
+            if path.name.startswith("."):
+                continue
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                # removed by a concurrent evaluation process
+                continue
+            yield st.st_mtime, st.st_size, path
+
+    def _scan_total_bytes(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self) -> None:
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            # free some headroom so that eviction does not run on every put
+            target = int(self.max_bytes * 0.9)
+
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                total -= size
+                self.evictions += 1
+
+            self._total_bytes = total
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "total_bytes": self._total_bytes if self._total_bytes is not None else self._scan_total_bytes(),
+                "max_bytes": self.max_bytes,
+            }
@@ -0,0 +1,333 @@
+import os
+import re
+import sys
+import json
+import time
+import pathlib
+import threading
+
+import datasets
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from typing import Dict, Optional, Tuple
+
+# the task yamls load this module by file path (see common.py)
+TASKS_DIR = os.path.dirname(os.path.abspath(__file__))
+if TASKS_DIR not in sys.path:
+    sys.path.insert(0, TASKS_DIR)
+import load_media  # noqa: E402
+
+from lm_eval.filters.extraction import RegexFilter
+from lm_eval.models.api_models import JsonChatStr
+
+
+FALLBACK = "-1"
+RUTIE_END_QUESTION_ID = 499
+TEMPLATE = "RUTIE_TARGET_{idx}"
+TARGET_PATTERN = re.compile(r"RUTIE_TARGET_(\d+)")
+REGEXP = RegexFilter(regex_pattern=r"\b([A-D])\b", group_select=0, fallback=FALLBACK)
+
+
+PROCESS_DOCS_VERSION = 2
+
+_process_docs_cache: Dict[str, datasets.Dataset] = {}
+
+
+def _dialog_positions(dataset: datasets.Dataset) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """question_id, dialog_id and dialog order of every row, computed on the Arrow id column."""
+    ids = pc.struct_field(dataset.data.column("meta").combine_chunks(), "id").to_numpy(zero_copy_only=False)
+    # meta.id is int32 in some subsets, the new fields are declared int64
+    ids = ids.astype(np.int64)
+    offset = ids - ids.min()
+    question_ids = offset % (RUTIE_END_QUESTION_ID + 1)
+    dialog_ids = offset // (RUTIE_END_QUESTION_ID + 1)
+    # dialogs one after another, questions of a dialog in order
+    order = np.lexsort((question_ids, dialog_ids))
+    return question_ids, dialog_ids, order
+
+
+def _cached_dialog_positions(dataset: datasets.Dataset) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # only the positions are kept on disk, the rows themselves stay in the HF cache
+    path = load_media.media_config.media_root / "processed_docs" / f"rutie-{dataset._fingerprint}-v{PROCESS_DOCS_VERSION}.npz"
+    try:
+        with np.load(path) as cached:
+            return cached["question_ids"], cached["dialog_ids"], cached["order"]
+    except (OSError, KeyError, ValueError):
+        pass
+
+    question_ids, dialog_ids, order = _dialog_positions(dataset)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.stem}.{os.getpid()}.tmp.npz")
+    np.savez(tmp_path, question_ids=question_ids, dialog_ids=dialog_ids, order=order)
+    os.replace(tmp_path, path)
+    return question_ids, dialog_ids, order
+
+
+def process_docs(dataset: datasets.Dataset) -> datasets.Dataset:
+    """
+    Replace meta.id with meta.question_id / meta.dialog_id and sort the rows by
+    dialog and question. Everything is done on Arrow columns: the new meta struct is
+    assembled from the existing child arrays and the sort is an indices mapping,
+    so no row is decoded or copied.
+    """
+    fingerprint = dataset._fingerprint
+    if fingerprint in _process_docs_cache:
+        return _process_docs_cache[fingerprint]
+
+    if dataset._indices is not None:
+        dataset = dataset.flatten_indices()
+    question_ids, dialog_ids, order = _cached_dialog_positions(dataset)
+
+    meta = dataset.data.column("meta").combine_chunks()
+    fields = [field for field in meta.type if field.name != "id"]
+    new_meta = pa.StructArray.from_arrays(
+        [meta.field(field.name) for field in fields] + [pa.array(question_ids, type=pa.int64()), pa.array(dialog_ids, type=pa.int64())],
+        names=[field.name for field in fields] + ["question_id", "dialog_id"],
+    )
+
+    features = dataset.features.copy()
+    meta_features = {name: feature for name, feature in features["meta"].items() if name != "id"}
+    meta_features["question_id"] = datasets.Value("int64")
+    meta_features["dialog_id"] = datasets.Value("int64")
+    features["meta"] = meta_features
+
+    info = dataset.info.copy()
+    info.features = features
+    table = dataset.data.set_column(dataset.column_names.index("meta"), "meta", new_meta)
+    processed = datasets.Dataset(
+        table,
+        info=info,
+        split=dataset.split,
+        fingerprint=f"{fingerprint}-rutie-v{PROCESS_DOCS_VERSION}",
+    ).select(order)
+
+    _process_docs_cache[fingerprint] = processed
+    return processed
+
+
+def process_docs_vision(dataset: datasets.Dataset) -> datasets.Dataset:
+    """process_docs of ruTiE-Image: the dialogs are ordered and the images resized for the whole split."""
+    return load_media.prepare_images(process_docs(dataset), ["image"])
+
+
+# The storage passed between requests by the harness maps dialog_id to the state of
+# that dialog ({"candidates": ..., "answers": {...}}). Dialogs never touch each other's
+# entries, so requests of different dialogs can be processed concurrently as long as
+# the requests of one dialog keep their order.
+
+
+def dialog_key(request) -> int:
+    """Id of the dialog the request belongs to, for grouping requests of independent dialogs."""
+    return request.doc["meta"]["dialog_id"]
+
+
+# RUTIE_JOURNAL_DIR=path records every dialog of the run there: the responses of the
+# model and the answers put into the history, one JSON line each, under a RUTIE_RUN_ID
+# subdirectory. Without RUTIE_RUN_ID every run gets its own id (start time and pid)
+# and a dialog's file is rewritten when the run starts it. A run started again with
+# the same RUTIE_RUN_ID resumes instead: the answers recorded for a dialog are
+# replayed into the storage when the dialog is first seen, and the recorded answer of
+# a question is kept over the new response, so the dialog history stays the same.
+JOURNAL_DIR = os.getenv("RUTIE_JOURNAL_DIR")
+RESUME = bool(os.getenv("RUTIE_RUN_ID"))
+RUN_ID = os.getenv("RUTIE_RUN_ID") or f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+
+_journal_lock = threading.Lock()
+# journal path -> {question_id: answer} recorded by the previous runs
+_recorded_answers: Dict[pathlib.Path, Dict[int, str]] = {}
+
+
+def _journal_path(request) -> Optional[pathlib.Path]:
+    if not JOURNAL_DIR:
+        return None
+    task = getattr(request, "task_name", None) or "rutie"
+    return pathlib.Path(JOURNAL_DIR) / RUN_ID / task / f"dialog_{dialog_key(request)}.jsonl"
+
+
+def _read_answers(path: pathlib.Path) -> Dict[int, str]:
+    answers = {}
+    if not RESUME or not path.exists():
+        return answers
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # a line cut by the crash
+                continue
+            if "answer" in record:
+                answers[record["question_id"]] = record["answer"]
+    return answers
+
+
+def _open_journal(path: pathlib.Path) -> Dict[int, str]:
+    """Recorded answers of the dialog; on the first call the journal is read or started. Call under _journal_lock."""
+    if path not in _recorded_answers:
+        _recorded_answers[path] = _read_answers(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if not RESUME:
+            path.write_text("", encoding="utf-8")
+        elif path.exists() and path.stat().st_size:
+            with open(path, "rb+") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    # finish the line cut by the crash, so the next record starts on its own line
+                    f.write(b"\n")
+    return _recorded_answers[path]
+
+
+def recorded_answers(request) -> Dict[int, str]:
+    """Answers to the questions of the request's dialog recorded by a previous run with the same RUTIE_RUN_ID."""
+    path = _journal_path(request)
+    if path is None:
+        return {}
+    with _journal_lock:
+        return _open_journal(path)
+
+
+def _append_journal(request, record: dict) -> None:
+    path = _journal_path(request)
+    if path is None:
+        return
+    with _journal_lock:
+        _open_journal(path)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False, default=float) + "\n")
+            f.flush()
+
+
+def replay_dialog(storage, request):
+    """Put the answers recorded for the request's dialog into the storage, if it has none yet."""
+    answers = recorded_answers(request)
+    if answers:
+        dialog = storage.setdefault(dialog_key(request), {})
+        recorded = {TEMPLATE.format(idx=question_id): answer for question_id, answer in answers.items()}
+        dialog["answers"] = {**recorded, **dialog.get("answers", {})}
+    return storage
+
+
+def replace_targets(string, max_num, storage):
+    # for consistency only
+    if max_num == 0:
+        return string
+    answers = storage["answers"]
+
+    def fill(match):
+        # only answers to the previous questions are known, later targets stay as is
+        if int(match.group(1)) >= max_num:
+            return match.group(0)
+        return answers[match.group(0)]
+
+    # string contains parts like RUTIE_TARGET_0, RUTIE_TARGET_1, so on;
+    # all of them are filled in a single pass over the prompt
+    return TARGET_PATTERN.sub(fill, string)
+
+
+def _update_request(storage, request):
+    # resumed run: the answers of the previous run fill the history from the first question on
+    if RESUME and JOURNAL_DIR:
+        replay_dialog(storage, request)
+    dialog = storage.get(dialog_key(request), {})
+
+    # sanity check, if req_id > 0 and storage is empty => something went wrong
+    if len(dialog) == 0 and request.doc["meta"]["question_id"] != 0:
+        print("No previous responses logged in storage!")
+        return request
+
+    max_num = request.doc["meta"]["question_id"]
+
+    # when string passed (everywhere except for API calls)
+    if isinstance(request.arguments[0], str):
+        new_req = replace_targets(request.arguments[0], max_num, dialog)
+        request.arguments = (new_req, *request.arguments[1:])
+    elif isinstance(request.arguments[0], list):
+        for el in request.arguments[0]:
+            for content in el["content"]:
+                if content["type"] == "text":
+                    content["text"] = replace_targets(content["text"], max_num, dialog)
+    else:
+        new_req = replace_targets(request.arguments[0].prompt, max_num, dialog)
+        new_req = JsonChatStr(new_req)
+        request.arguments = (new_req, *request.arguments[1:])
+
+    return request
+
+
+def _update_storage(storage, request):
+    req_id = request.doc["meta"]["question_id"]
+    # dict.setdefault is atomic, so concurrent dialogs can create their entries safely
+    dialog = storage.setdefault(dialog_key(request), {})
+    _append_journal(request, {"question_id": req_id, "idx": getattr(request, "idx", 0), "resp": request.resps[0]})
+
+    # check that the set is over to clear storage
+    if not isinstance(request.arguments[1], dict):
+        dialog_ends = (
+            request.doc["meta"]["question_id"] == RUTIE_END_QUESTION_ID
+            and len(dialog.get("candidates", [])) == 1
+        )
+    else:
+        dialog_ends = request.doc["meta"]["question_id"] == RUTIE_END_QUESTION_ID
+
+    # clear the dialog state after it ends
+    if dialog_ends:
+        storage.pop(dialog_key(request), None)
+        return storage
+
+    # loglikelihood setup
+    if not isinstance(request.arguments[1], dict):
+        # update storage only after running 2 requests for the same sample
+        dialog.setdefault("candidates", []).extend([request.resps[0][0]])
+        # need 2 probas to decide on the answer
+        if len(dialog["candidates"]) == 2:
+            # decide on the answer
+            result = ["1", "2"][np.argmax(dialog["candidates"])]
+            # get string that includes the context
+            _store_answer(request, dialog, req_id, result)
+            # discard candidates
+            dialog["candidates"] = []
+
+    # generative setup
+    else:
+        # pick LM answer and truncate spaces
+        dialog["candidates"] = request.resps[0].strip()
+
+        # apply filter to response to get digit out of LM answer
+        string_answer = extract_string([dialog["candidates"]])
+        filtered_answer = REGEXP.apply([[string_answer]], None)
+
+        # might not find pattern - replace with FALLBACK
+        result = (
+            FALLBACK
+            if (not len(filtered_answer) or not filtered_answer[0])
+            else filtered_answer[0][0]
+        )
+
+        # store LM filtered answer
+        _store_answer(request, dialog, req_id, result)
+
+    return storage
+
+
+def _store_answer(request, dialog, req_id, result):
+    recorded = recorded_answers(request)
+    if req_id in recorded:
+        # resumed run: the next questions were asked after the recorded answer, keep it
+        result = recorded[req_id]
+    else:
+        _append_journal(request, {"question_id": req_id, "answer": result})
+    dialog.setdefault("answers", {})[TEMPLATE.format(idx=req_id)] = result
+
+
+def extract_string(nested_list):
+    for item in nested_list:
+        if isinstance(item, list):
+            # If the item is a list, call the function recursively
+            result = extract_string(item)
+            if result is not None:
+                return result
+        elif isinstance(item, str):
+            # If the item is a string, return it
+            return item
+    return None
@@ -0,0 +1,104 @@
+"""
+Per-image overhead of resolving media settings in load_media.
+
+Compares the settings lookups the loaders used to do on every image (os.getenv +
+parsing for HARNESS_RESIZE_IMAGES, INPUT_IMAGE_*, MEDIA_MAX_PAYLOAD_BYTES and a
+mkdir of the media root and subdir on every saved file) with reading the MediaConfig
+built at import, and times get_image end to end on a synthetic dataset.
+
+Run from the repository root:
+
+    python scripts/benchmarks/load_media_overhead.py --num-images 10000
+"""
+import argparse
+import io
+import os
+import pathlib
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[2] / "multimodal_tasks"))
+
+
+def _legacy_env_int(name):
+    value = os.getenv(name)
+    return int(value) if value and value.isdigit() else None
+
+
+def legacy_settings(subdir: str):
+    """Settings lookups as they were done per image before MediaConfig."""
+    do_resize = os.getenv("HARNESS_RESIZE_IMAGES", "false").lower() in ("1", "true", "yes")
+    dims = _legacy_env_int("INPUT_IMAGE_WIDTH"), _legacy_env_int("INPUT_IMAGE_HEIGHT"), _legacy_env_int("INPUT_IMAGE_MAX_SIDE")
+    image_format = os.getenv("INPUT_IMAGE_FORMAT", "").upper()
+    quality = int(os.getenv("INPUT_IMAGE_QUALITY", "90"))
+    budget = _legacy_env_int("MEDIA_MAX_PAYLOAD_BYTES")
+
+    root = os.getenv("LM_EVAL_MEDIA_DIR") or os.getenv("HF_HOME") or str(pathlib.Path.home() / ".cache" / "huggingface")
+    media_root = pathlib.Path(root) / "lm_eval_media"
+    media_root.mkdir(parents=True, exist_ok=True)
+    out_dir = media_root / subdir
+    out_dir.mkdir(parents=True, exist_ok=True)
+    return do_resize, dims, image_format, quality, budget, out_dir
+
+
+def config_settings(load_media, subdir: str):
+    """The same settings read from the MediaConfig built once at import."""
+    config = load_media.media_config
+    return (
+        config.resize_images,
+        config.resize_dims,
+        config.image_format,
+        config.image_quality,
+        config.max_payload_bytes,
+        load_media._ensure_dir(config.media_root / subdir),
+    )
+
+
+def synthetic_images(num_images: int, size: int):
+    images = []
+    for i in range(num_images):
+        buffer = io.BytesIO()
+        Image.new("RGB", (size, size), (i % 256, (i // 256) % 256, 128)).save(buffer, format="PNG")
+        images.append({"bytes": buffer.getvalue(), "path": None})
+    return images
+
+
+def timed(fn, items) -> float:
+    start = time.perf_counter()
+    for item in items:
+        fn(item)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-images", type=int, default=10000)
+    parser.add_argument("--image-size", type=int, default=64)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["LM_EVAL_MEDIA_DIR"] = tmp
+        os.environ.setdefault("LOAD_FILES", "1")
+
+        import load_media
+        load_media.reload_media_config()
+
+        images = synthetic_images(args.num_images, args.image_size)
+        n = len(images)
+
+        legacy = timed(lambda _: legacy_settings("images"), images)
+        config = timed(lambda _: config_settings(load_media, "images"), images)
+        end_to_end = timed(load_media.get_image, images)
+
+    print(f"images: {n}")
+    print(f"settings per image, per-call env + mkdir: {legacy / n * 1e6:8.2f} us")
+    print(f"settings per image, MediaConfig:          {config / n * 1e6:8.2f} us")
+    print(f"get_image per image, end to end:          {end_to_end / n * 1e6:8.2f} us")
+    print(f"saved per 10k images:                     {(legacy - config) / n * 1e4 * 1e3:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
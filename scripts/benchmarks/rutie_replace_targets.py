@@ -0,0 +1,75 @@
+"""
+Cost of filling RUTIE_TARGET_* placeholders over a full ruTiE dialog.
+
+Every question of a dialog carries the history of all previous questions, and
+the placeholders of the previous answers are filled before the request is sent.
+The legacy implementation called str.replace on the whole prompt once per
+previous question; rutie_storage.replace_targets fills them in one regex pass.
+
+Run from the repository root:
+
+    python scripts/benchmarks/rutie_replace_targets.py --num-questions 500
+"""
+import argparse
+import pathlib
+import sys
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[2] / "multimodal_tasks"))
+
+from rutie_storage import TEMPLATE, replace_targets  # noqa: E402
+
+QUESTION = (
+    "Картинка: <image>\n"
+    "Что изображено на картинке и как это связано с предыдущим ответом?\n"
+    "A. Первый вариант\nB. Второй вариант\nC. Третий вариант\nD. Четвертый вариант\n"
+    "Ответ: {target}"
+)
+
+
+def legacy_replace_targets(string, max_num, storage):
+    if max_num == 0:
+        return string
+    for idx in range(max_num - 1, -1, -1):
+        to_fill = TEMPLATE.format(idx=idx)
+        string = string.replace(to_fill, storage["answers"][to_fill])
+    return string
+
+
+def dialog_prompts(num_questions: int):
+    history = []
+    for idx in range(num_questions):
+        history.append(QUESTION.format(target=TEMPLATE.format(idx=idx)))
+        # the prompt of question idx holds the previous questions with their targets
+        yield idx, "\n\n".join(history[:-1] + [QUESTION.format(target="")])
+
+
+def run(fn, num_questions: int, storage) -> float:
+    start = time.perf_counter()
+    for idx, prompt in dialog_prompts(num_questions):
+        fn(prompt, idx, storage)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-questions", type=int, default=500)
+    args = parser.parse_args()
+
+    storage = {"answers": {TEMPLATE.format(idx=idx): "ABCD"[idx % 4] for idx in range(args.num_questions)}}
+
+    for idx, prompt in dialog_prompts(args.num_questions):
+        assert legacy_replace_targets(prompt, idx, storage) == replace_targets(prompt, idx, storage)
+
+    baseline = run(lambda *a: None, args.num_questions, storage)
+    legacy = run(legacy_replace_targets, args.num_questions, storage) - baseline
+    single_pass = run(replace_targets, args.num_questions, storage) - baseline
+
+    print(f"questions in dialog: {args.num_questions}")
+    print(f"str.replace per target: {legacy * 1e3:9.1f} ms")
+    print(f"single regex pass:      {single_pass * 1e3:9.1f} ms")
+    print(f"speedup:                {legacy / single_pass:9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
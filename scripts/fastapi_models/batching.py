@@ -0,0 +1,206 @@
+from __future__ import annotations
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+@dataclass
+class PendingRequest:
+    key: Hashable
+    messages: Any
+    future: asyncio.Future = field(repr=False)
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class QueueFullError(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"Inference queue is full, retry after {retry_after} s")
+        self.retry_after = retry_after
+
+
+def _percentile(values, q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class BatchScheduler:
+    """
+    Collects concurrent chat requests into batches.
+
+    The first request waits at most max_wait seconds for others with the same key
+    (model and generation params), then up to max_batch_size of them go to
+    run_batch(key, list_of_messages) together. Requests with another key stay in
+    the queue for the next batches in their arrival order.
+
+    run_batch (model loading and generation) runs in a single dedicated thread, so
+    the event loop keeps serving other endpoints meanwhile. When a batch fails, its
+    requests are run again one by one, so a single bad request fails only itself. With
+    max_queue_size > 0 only that many requests may wait and submit raises
+    QueueFullError for the rest; 0 leaves the queue unbounded.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[Hashable, List[Any]], List[Any]],
+        max_batch_size: int,
+        max_wait: float,
+        max_queue_size: int = 0,
+        stats_window: int = 1000,
+    ):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        self.max_queue_size = max_queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._leftover: List[PendingRequest] = []
+        self._worker: Optional[asyncio.Task] = None
+        # one thread: models are not safe to call concurrently
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._queue_waits = deque(maxlen=stats_window)
+        self._latencies = deque(maxlen=stats_window)
+        self._batch_times = deque(maxlen=stats_window)
+        self._batch_sizes = deque(maxlen=stats_window)
+
+    @classmethod
+    def from_env(cls, run_batch) -> "BatchScheduler":
+        return cls(
+            run_batch,
+            max_batch_size=int(os.getenv("MAX_BATCH_SIZE", "8")),
+            max_wait=float(os.getenv("BATCH_MAX_WAIT_MS", "20")) / 1000,
+            max_queue_size=int(os.getenv("MAX_QUEUE_SIZE", "0")),
+        )
+
+    @property
+    def queue_depth(self) -> int:
+        return (self._queue.qsize() if self._queue is not None else 0) + len(self._leftover)
+
+    def _retry_after(self) -> int:
+        # time to drain the queue with the recent batch duration
+        batch_time = sum(self._batch_times) / len(self._batch_times) if self._batch_times else 1.0
+        return max(1, math.ceil(batch_time * math.ceil(self.queue_depth / self.max_batch_size)))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self.queue_depth,
+            "max_queue_size": self.max_queue_size,
+            "running": self._running,
+            "completed": self._completed,
+            "failed": self._failed,
+            "rejected": self._rejected,
+            "mean_batch_size": sum(self._batch_sizes) / len(self._batch_sizes) if self._batch_sizes else None,
+            "queue_wait_p50_s": _percentile(self._queue_waits, 0.5),
+            "queue_wait_p95_s": _percentile(self._queue_waits, 0.95),
+            "latency_p50_s": _percentile(self._latencies, 0.5),
+            "latency_p95_s": _percentile(self._latencies, 0.95),
+        }
+
+    async def submit(self, key: Hashable, messages: Any) -> Any:
+        if self._worker is None:
+            # created here to bind the queue and the worker to the running loop
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        if self.max_queue_size and self.queue_depth >= self.max_queue_size:
+            self._rejected += 1
+            raise QueueFullError(self._retry_after())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(PendingRequest(key, messages, future))
+        return await future
+
+    def _take_leftover(self, key: Hashable, batch: List[PendingRequest]) -> None:
+        rest = []
+        for item in self._leftover:
+            if item.key == key and len(batch) < self.max_batch_size:
+                batch.append(item)
+            else:
+                rest.append(item)
+        self._leftover = rest
+
+    async def _collect(self) -> List[PendingRequest]:
+        first = self._leftover.pop(0) if self._leftover else await self._queue.get()
+        batch = [first]
+        self._take_leftover(first.key, batch)
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if item.key == first.key:
+                batch.append(item)
+            else:
+                self._leftover.append(item)
+        return batch
+
+    def _run_items(self, key: Hashable, messages: List[Any]) -> List[Tuple[bool, Any]]:
+        """(ok, result or exception) for every request, called in the inference thread."""
+        try:
+            results = list(self.run_batch(key, messages))
+        except Exception as e:
+            if len(messages) == 1:
+                return [(False, e)]
+        else:
+            outcomes = [(True, result) for result in results[:len(messages)]]
+            if len(results) != len(messages):
+                # every request must be answered, otherwise its client waits forever
+                error = RuntimeError(f"run_batch returned {len(results)} results for {len(messages)} requests")
+                outcomes += [(False, error)] * (len(messages) - len(outcomes))
+            return outcomes
+
+        outcomes = []
+        for item in messages:
+            try:
+                outcomes.append((True, self.run_batch(key, [item])[0]))
+            except Exception as e:
+                outcomes.append((False, e))
+        return outcomes
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._collect()
+            # the client may have gone away while waiting
+            batch = [item for item in batch if not item.future.cancelled()]
+            if not batch:
+                continue
+
+            started = time.monotonic()
+            self._queue_waits.extend(started - item.enqueued_at for item in batch)
+            self._running = len(batch)
+            try:
+                outcomes = await asyncio.get_running_loop().run_in_executor(
+                    self._executor, self._run_items, batch[0].key, [item.messages for item in batch]
+                )
+            finally:
+                self._running = 0
+
+            finished = time.monotonic()
+            self._batch_times.append(finished - started)
+            self._batch_sizes.append(len(batch))
+            self._latencies.extend(finished - item.enqueued_at for item in batch)
+            for item, (ok, result) in zip(batch, outcomes):
+                if ok:
+                    self._completed += 1
+                else:
+                    self._failed += 1
+                if item.future.done():
+                    continue
+                if ok:
+                    item.future.set_result(result)
+                else:
+                    item.future.set_exception(result)
@@ -1,41 +1,49 @@
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
-import gc
-
-import torch
 
+from batching import BatchScheduler, QueueFullError
+from model_pool import ModelPool
 from models import MODELS_REGISTRY
+from utils.media import decoded_media_cache
 
 app = FastAPI(title="Minimal Chat Completions Server", version="0.0.1")
 
-LAST_USED_MODEL = None
-LAST_USED_MODEL_PARAMS = None
 
+def load_model(model_name):
+    return MODELS_REGISTRY[model_name](model_name=model_name)
 
-@app.post("/v1/chat/completions")
-async def chat_completions(req: Request):
-    global LAST_USED_MODEL, LAST_USED_MODEL_PARAMS
-    body = await req.json()
 
-    params = {
-        "model_name": body["model"],
-        "max_new_tokens": body["max_completion_tokens"],
-    }
+# loaded models are kept by name only, generation params are set per batch
+pool = ModelPool.from_env(load_model)
+
+
+def run_batch(key, batch_messages):
+    model_name, max_new_tokens = key
+    model = pool.get(model_name)
+    model.max_new_tokens = max_new_tokens
+    return model.generate_batch(batch_messages)
+
 
-    if LAST_USED_MODEL_PARAMS != params:
-        if LAST_USED_MODEL:
-            LAST_USED_MODEL = None
+# concurrent requests to the same model are answered by one generate_batch call
+scheduler = BatchScheduler.from_env(run_batch)
 
-            gc.collect()
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
-                torch.cuda.ipc_collect()
 
-        LAST_USED_MODEL = MODELS_REGISTRY[params["model_name"]](**params)
-        LAST_USED_MODEL_PARAMS = params
+@app.post("/v1/chat/completions")
+async def chat_completions(req: Request):
+    body = await req.json()
+
+    # requests to one model with the same max_new_tokens can share a batch
+    key = (body["model"], body["max_completion_tokens"])
 
     messages = body["messages"]
-    result = LAST_USED_MODEL.generate(messages)
+    try:
+        result = await scheduler.submit(key, messages)
+    except QueueFullError as e:
+        return JSONResponse(
+            {"error": {"message": str(e), "type": "queue_full"}},
+            status_code=429,
+            headers={"Retry-After": str(e.retry_after)},
+        )
 
     json_result = {
         "choices": [
@@ -54,3 +62,13 @@ async def chat_completions(req: Request):
 @app.get("/v1/models")
 async def list_models():
     return {"models": [{"id": k} for k in MODELS_REGISTRY.keys()]}
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+@app.get("/metrics")
+async def metrics():
+    return {**scheduler.stats(), "models": pool.stats(), "media_cache": decoded_media_cache.stats()}
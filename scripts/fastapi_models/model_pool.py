@@ -0,0 +1,166 @@
+from __future__ import annotations
+import gc
+import os
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List
+
+import torch
+
+GB = 1024 ** 3
+
+
+def _modules(model) -> List[torch.nn.Module]:
+    modules = []
+    for value in vars(model).values():
+        # transformers pipelines (ultravox) keep the network in .model
+        if not isinstance(value, torch.nn.Module):
+            value = getattr(value, "model", None)
+        if isinstance(value, torch.nn.Module):
+            modules.append(value)
+    return modules
+
+
+def model_bytes(model) -> int:
+    """
+    Size of the weights and buffers of all torch modules held by the model wrapper,
+    directly or through a transformers pipeline. Wrappers of remote APIs hold none and
+    take 0 bytes.
+    """
+    total = 0
+    for module in _modules(model):
+        for tensor in list(module.parameters()) + list(module.buffers()):
+            total += tensor.numel() * tensor.element_size()
+    return total
+
+
+# bytes per parameter of the safetensors dtypes
+_DTYPE_BYTES = {"F64": 8, "I64": 8, "F32": 4, "I32": 4, "F16": 2, "BF16": 2, "I16": 2}
+
+
+def checkpoint_bytes(model_name: str) -> int:
+    """Size of the weights in the safetensors checkpoint of a hub model, 0 when unknown."""
+    try:
+        from huggingface_hub import get_safetensors_metadata
+
+        metadata = get_safetensors_metadata(model_name)
+    except Exception:
+        return 0
+    return sum(count * _DTYPE_BYTES.get(dtype, 1) for dtype, count in metadata.parameter_count.items())
+
+
+def _can_offload(model) -> bool:
+    # weights dispatched by accelerate over several devices can't be moved back with .to()
+    for module in _modules(model):
+        device_map = getattr(module, "hf_device_map", None)
+        if device_map and len(set(device_map.values())) > 1:
+            return False
+    return bool(_modules(model))
+
+
+def _move(model, device) -> None:
+    for module in _modules(model):
+        module.to(device)
+
+
+def _free_memory() -> None:
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+        torch.cuda.ipc_collect()
+
+
+class ModelPool:
+    """
+    Loaded models keyed by model name, least recently used evicted first.
+
+    At most max_models models stay on the device and their weights take at most
+    memory_budget bytes (0 - no limit). With offload_to_cpu an evicted model is moved
+    to CPU RAM, up to cpu_memory_budget bytes, and is moved back instead of being
+    loaded from disk again. Models spread by device_map="auto" over several devices
+    are dropped instead.
+
+    Room is made before a model is loaded, so the evicted weights are freed before the
+    new ones are allocated. The size of a model is taken from its previous load or
+    estimated from its safetensors checkpoint; when it is unknown and memory_budget is
+    set, all other models are evicted first.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[str], Any],
+        max_models: int = 1,
+        memory_budget: int = 0,
+        offload_to_cpu: bool = False,
+        cpu_memory_budget: int = 0,
+    ):
+        self.factory = factory
+        self.max_models = max(1, max_models)
+        self.memory_budget = memory_budget
+        self.offload_to_cpu = offload_to_cpu
+        self.cpu_memory_budget = cpu_memory_budget
+        # name -> (model, bytes), the last one is the most recently used
+        self._resident: "OrderedDict[str, tuple]" = OrderedDict()
+        self._offloaded: "OrderedDict[str, tuple]" = OrderedDict()
+        # name -> bytes of every model loaded so far
+        self._known_sizes: Dict[str, int] = {}
+
+    @classmethod
+    def from_env(cls, factory) -> "ModelPool":
+        return cls(
+            factory,
+            max_models=int(os.getenv("MODEL_POOL_MAX_MODELS", "1")),
+            memory_budget=int(float(os.getenv("MODEL_POOL_MEMORY_GB", "0")) * GB),
+            offload_to_cpu=os.getenv("MODEL_POOL_OFFLOAD_CPU") == "1",
+            cpu_memory_budget=int(float(os.getenv("MODEL_POOL_CPU_MEMORY_GB", "0")) * GB),
+        )
+
+    def _used(self, models) -> int:
+        return sum(size for _, size in models.values())
+
+    def _over_budget(self, incoming: int) -> bool:
+        if len(self._resident) >= self.max_models:
+            return True
+        return bool(self.memory_budget) and self._used(self._resident) + incoming > self.memory_budget
+
+    def _evict_lru(self) -> None:
+        name, (model, size) = self._resident.popitem(last=False)
+        if self.offload_to_cpu and _can_offload(model):
+            _move(model, "cpu")
+            self._offloaded[name] = (model, size)
+            while self.cpu_memory_budget and self._used(self._offloaded) > self.cpu_memory_budget:
+                self._offloaded.popitem(last=False)
+        del model
+        _free_memory()
+
+    def get(self, model_name: str):
+        if model_name in self._resident:
+            self._resident.move_to_end(model_name)
+            return self._resident[model_name][0]
+
+        if model_name in self._offloaded:
+            model, size = self._offloaded.pop(model_name)
+            while self._resident and self._over_budget(size):
+                self._evict_lru()
+            _move(model, model.device)
+        else:
+            expected = self._known_sizes.get(model_name)
+            if expected is None:
+                expected = checkpoint_bytes(model_name)
+            unknown = not expected and model_name not in self._known_sizes and bool(self.memory_budget)
+            while self._resident and (unknown or self._over_budget(expected)):
+                self._evict_lru()
+            model = self.factory(model_name)
+            size = model_bytes(model) or expected
+            self._known_sizes[model_name] = size
+
+        self._resident[model_name] = (model, size)
+        # the new model is the last one, so only older models are evicted here
+        while len(self._resident) > 1 and self.memory_budget and self._used(self._resident) > self.memory_budget:
+            self._evict_lru()
+        return model
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "resident": {name: size for name, (_, size) in self._resident.items()},
+            "offloaded": {name: size for name, (_, size) in self._offloaded.items()},
+        }
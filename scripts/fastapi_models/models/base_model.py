@@ -2,7 +2,7 @@ from __future__ import annotations
 from abc import ABC, abstractmethod
 import os
 
-from utils.base64_to_file import save_base64_to_file
+from utils.media import save_to_tmpfs, tmpfs_files
 
 
 class BaseModel(ABC):
@@ -26,15 +26,17 @@ class BaseModel(ABC):
     def _generate(self, request):
         raise NotImplementedError
 
-    def generate(self, request):
+    def _generate_batch(self, requests):
+        # models that can run a padded batch through the processor override this
+        return [self._generate(request) for request in requests]
+
+    def _transcribe_audio(self, request):
         if os.getenv("PROCESS_AUDIO_WITH_AUDIO_MODEL"):
             for message in request:
                 for content in message["content"]:
                     if content["type"] == "audio_url":
                         from transformers import AutoModel
 
-                        audio_file = save_base64_to_file(content["audio_url"]["url"], output_dir="audio_model_tmp")
-
                         if self.audio_model is None:
                             revision = os.getenv("AUDIO_MODEL_REVISION")
                             audio_model = os.getenv("AUDIO_MODEL_NAME")
@@ -44,22 +46,27 @@ class BaseModel(ABC):
                                 trust_remote_code=True,
                             ).to(self.device)
 
-                        try:
-                            transcription = self.audio_model.transcribe(audio_file)
-                        except:
-                            transcription = self.audio_model.transcribe_longform(audio_file)
-                            transcription = "\n".join(t["transcription"] for t in transcription)
+                        with tmpfs_files() as tmp_files:
+                            audio_file = save_to_tmpfs(content["audio_url"]["url"], "audio_model_tmp")
+                            tmp_files.append(audio_file)
+                            try:
+                                transcription = self.audio_model.transcribe(audio_file)
+                            except:
+                                transcription = self.audio_model.transcribe_longform(audio_file)
+                                transcription = "\n".join(t["transcription"] for t in transcription)
 
                         content["type"] = "text"
                         content["text"] = transcription
                         del content["audio_url"]
 
-                        try:
-                            os.remove(audio_file)
-                        except:
-                            print(f"Could not remove {audio_file}")
+        return request
+
+    def generate(self, request):
+        return self._generate(self._transcribe_audio(request))
 
-        return self._generate(request)
+    def generate_batch(self, requests):
+        """Answers to several independent conversations, in the order of requests."""
+        return self._generate_batch([self._transcribe_audio(request) for request in requests])
 
     @abstractmethod
     def init_model(self):
@@ -2,9 +2,10 @@ import os
 import json
 import requests
 import hashlib
+import uuid
 
 from models.base_model import BaseModel
-from utils.base64_to_file import save_base64_to_file
+from utils.media import decode_data_url
 
 
 class CustomModel(BaseModel):
@@ -19,18 +20,19 @@ class CustomModel(BaseModel):
                 if p["type"] == "text":
                     text_content += p["text"]
                 else:
-                    b64 = p["audio_url"]["url"]
+                    # media repeated in long dialogs (ruTiE history) are uploaded once and
+                    # referenced by their file id afterwards
+                    b64 = p[p["type"]]["url"]
                     b64_hash = hashlib.sha256(b64.encode("utf-8")).hexdigest()
 
                     if b64_hash in self.base_file_id_storage:
-                        audio_id = self.base_file_id_storage[b64_hash]
+                        file_id = self.base_file_id_storage[b64_hash]
                     else:
-                        path = save_base64_to_file(b64, output_dir="tmp_audio")
-                        audio_id = self.upload_file(path)["id"]
-                        self.base_file_id_storage[b64_hash] = audio_id
+                        file_id = self.upload_file(b64)["id"]
+                        self.base_file_id_storage[b64_hash] = file_id
                         json.dump(self.base_file_id_storage, open(self.base_file_id_storage_path, "w"), indent=4)
 
-                    attachments.append(audio_id)
+                    attachments.append(file_id)
 
             msgs.append({"role": m["role"], "content": text_content, "attachments": attachments})
 
@@ -48,7 +50,7 @@ class CustomModel(BaseModel):
             self.base_file_id_storage = {}
         self.token = os.getenv("CUSTOM_MODEL_TOKEN")
 
-    def upload_file(self, file_path) -> dict:
+    def upload_file(self, data_url) -> dict:
         url = f"{self.base_url}/files"
 
         access_token = self.token
@@ -57,25 +59,16 @@ class CustomModel(BaseModel):
             "Authorization": f"Bearer {access_token}"
         }
 
-        with open(file_path, 'rb') as file:
-            file_name = os.path.basename(file_path)
-            file_type = file_path.split('.')[-1]
-            file_type_to_mime = {
-                'png': 'image/png',
-                'jpg': 'image/jpeg',
-                'jpeg': 'image/jpeg',
-                'gif': 'image/gif',
-                'bmp': 'image/bmp',
-                'wav': 'audio/wav',
-                'mp3': 'audio/mpeg',
-            }
-            files = {
-                'file': (file_name, file, file_type_to_mime[file_type])
-            }
-            data = {
-                "purpose": "general"
-            }
-            response = requests.post(url, verify=False, headers=headers, files=files, data=data)
+        # the payload is sent from memory, the extension of the name follows the mime type
+        mime, binary = decode_data_url(data_url)
+        file_type = mime.split("/", 1)[1].split("+")[0]
+        files = {
+            'file': (f"{uuid.uuid4().hex}.{file_type}", binary, mime)
+        }
+        data = {
+            "purpose": "general"
+        }
+        response = requests.post(url, verify=False, headers=headers, files=files, data=data)
 
         if response.status_code == 200:
             result = response.json()
@@ -1,4 +1,3 @@
-import os
 import math
 import numpy as np
 import torch
@@ -8,13 +7,11 @@ from decord import VideoReader, cpu
 from torchvision.transforms.functional import InterpolationMode
 
 from models.base_model import BaseModel
-from utils.base64_to_file import save_base64_to_file
+from utils.media import cached, media_buffer
 
 
 class InternVL35VideoChatModel(BaseModel):
     def _generate(self, messages):
-        tmp_video = None
-
         pixel_values = None
         num_patches_list = None
 
@@ -25,8 +22,13 @@ class InternVL35VideoChatModel(BaseModel):
                     parts.append(c["text"])
                 else:
                     first_video_b64 = c["video_url"]["url"]
-                    tmp_video = save_base64_to_file(first_video_b64, output_dir="tmp_video")
-                    pixel_values, num_patches_list = self._load_video(tmp_video, num_segments=8, max_num=1)
+                    # decord reads the video straight from memory; frame sampling and tiling
+                    # of a video already seen are taken from the cache
+                    pixel_values, num_patches_list = cached(
+                        first_video_b64,
+                        ("internvl_video", 8, 1),
+                        lambda: self._load_video(media_buffer(first_video_b64), num_segments=8, max_num=1),
+                    )
                     pixel_values = pixel_values.to(torch.bfloat16).to(self.model.device)
                     prefix = "".join([f"Frame{i+1}: <image>\n" for i in range(len(num_patches_list))])
                     parts.append(prefix)
@@ -44,11 +46,6 @@ class InternVL35VideoChatModel(BaseModel):
             return_history=True,
         )
 
-        try:
-            os.remove(tmp_video)
-        except Exception:
-            pass
-
         print(response)
 
         return response
@@ -133,8 +130,8 @@ class InternVL35VideoChatModel(BaseModel):
         ])
         return frame_indices
 
-    def _load_video(self, video_path, bound=None, input_size=448, max_num=1, num_segments=32):
-        vr = VideoReader(video_path, ctx=cpu(0), num_threads=1)
+    def _load_video(self, video, bound=None, input_size=448, max_num=1, num_segments=32):
+        vr = VideoReader(video, ctx=cpu(0), num_threads=1)
         max_frame = len(vr) - 1
         fps = float(vr.get_avg_fps())
 
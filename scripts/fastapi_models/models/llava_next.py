@@ -1,16 +1,15 @@
 import av
 import torch
 import numpy as np
-import os
 
 from models.base_model import BaseModel
-from utils.base64_to_file import save_base64_to_file
+from utils.media import cached, media_buffer
 
 
 class LlavaNext(BaseModel):
     def _generate(self, messages):
         msgs = []
-        tmp_files = []
+        video_b64 = None
 
         for m in messages:
             parts = []
@@ -18,18 +17,12 @@ class LlavaNext(BaseModel):
                 if p["type"] == "text":
                     parts.append({"type": "text", "text": p["text"]})
                 else:
-                    b64 = p["video_url"]["url"]
-                    video_path = save_base64_to_file(b64, output_dir="tmp_video")
-                    tmp_files.append(video_path)
+                    video_b64 = p["video_url"]["url"]
                     parts.append({"type": "video"})
             msgs.append({"role": m["role"], "content": parts})
 
         prompt = self.processor.apply_chat_template(msgs, add_generation_prompt=True)
-        container = av.open(video_path)
-
-        total_frames = container.streams.video[0].frames
-        indices = np.arange(0, total_frames, total_frames / 8).astype(int)
-        clip = self.read_video_pyav(container, indices)
+        clip = cached(video_b64, "llava_next_video", lambda: self._read_clip(video_b64))
         inputs_video = self.processor(text=prompt, videos=clip, padding=True, return_tensors="pt").to(self.model.device)
 
         input_ids_len = inputs_video.input_ids.size(1)
@@ -37,14 +30,16 @@ class LlavaNext(BaseModel):
         output = self.model.generate(**inputs_video, max_new_tokens=self.max_new_tokens, do_sample=False)
         text = self.processor.decode(output[0][input_ids_len:], skip_special_tokens=True)
 
-        for p in tmp_files:
-            try:
-                os.remove(p)
-            except:
-                pass
-
         return text
 
+    def _read_clip(self, video_b64, num_frames=8):
+        # PyAV demuxes the video straight from memory
+        container = av.open(media_buffer(video_b64))
+
+        total_frames = container.streams.video[0].frames
+        indices = np.arange(0, total_frames, total_frames / num_frames).astype(int)
+        return self.read_video_pyav(container, indices)
+
     def read_video_pyav(self, container, indices):
         '''
         Decode the video with PyAV decoder.
@@ -1,7 +1,7 @@
 import os
 
 from models.base_model import BaseModel
-from utils.base64_to_file import save_base64_to_file
+from utils.media import cached, load_audio, load_image, save_to_tmpfs
 
 import math
 import numpy as np
@@ -42,8 +42,16 @@ class MiniCPM(BaseModel):
 
         return contents
 
+    def _video_chunk_content(self, b64):
+        # moviepy reads only from a path
+        path = save_to_tmpfs(b64, "tmp_video")
+        try:
+            return self.get_video_chunk_content(path)
+        finally:
+            os.remove(path)
+
     def _generate(self, messages):
-        conversation, tmp_files = [], []
+        conversation = []
 
         for m in messages:
             parts = []
@@ -54,25 +62,17 @@ class MiniCPM(BaseModel):
                     parts.append(p["text"])
                 elif t == "image_url":
                     b64 = p["image_url"]["url"]
-                    path = save_base64_to_file(b64, output_dir="tmp_image")
-                    img = Image.open(path).convert('RGB')
-                    parts.append(img)
-                    tmp_files.append(path)
+                    parts.append(load_image(b64))
                 elif t == "audio_url":
                     if not first_audio:
                         continue
                     first_audio = False
                     b64 = p["audio_url"]["url"]
-                    path = save_base64_to_file(b64, output_dir="tmp_audio")
-                    tmp_files.append(path)
-                    audio_input, _ = librosa.load(path, sr=16000, mono=True)
+                    audio_input, _ = load_audio(b64, sr=16000, mono=True)
                     parts.append(audio_input)
                 else:
                     b64 = p["video_url"]["url"]
-                    path = save_base64_to_file(b64, output_dir="tmp_video")
-                    contents = self.get_video_chunk_content(path)
-                    tmp_files.append(path)
-                    parts.extend(contents)
+                    parts.extend(cached(b64, "minicpm_video", lambda: self._video_chunk_content(b64)))
             conversation.append({"role": m["role"], "content": parts})
 
         res = self.model.chat(
@@ -85,12 +85,6 @@ class MiniCPM(BaseModel):
             return_dict=True
         )
 
-        for p in tmp_files:
-            try:
-                os.remove(p)
-            except Exception:
-                pass
-
         return res.text
 
     def init_model(self):
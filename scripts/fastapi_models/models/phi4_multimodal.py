@@ -1,11 +1,9 @@
-import os
 import soundfile as sf
-from PIL import Image
 
 from transformers import AutoModelForCausalLM, AutoProcessor, GenerationConfig
 
 from models.base_model import BaseModel
-from utils.base64_to_file import save_base64_to_file
+from utils.media import load_image, media_buffer
 
 
 class Phi4MultimodalChatModel(BaseModel):
@@ -15,7 +13,6 @@ class Phi4MultimodalChatModel(BaseModel):
         images = []
         audio_idx = 1
         image_idx = 1
-        files = []
 
         for m in messages:
             role = m["role"]
@@ -30,17 +27,13 @@ class Phi4MultimodalChatModel(BaseModel):
                     dialog.append(part["text"])
                 elif t == "audio_url":
                     b64 = part["audio_url"]["url"]
-                    path = save_base64_to_file(b64, output_dir="tmp_audio")
-                    files.append(path)
-                    audio, sr = sf.read(path)
+                    audio, sr = sf.read(media_buffer(b64))
                     audios.append((audio, sr))
                     dialog.append(f"<|audio_{audio_idx}|>")
                     audio_idx += 1
                 elif t == "image_url":
                     b64 = part["image_url"]["url"]
-                    path = save_base64_to_file(b64, output_dir="tmp_image")
-                    files.append(path)
-                    img = Image.open(path).convert('RGB')
+                    img = load_image(b64)
                     images.append(img)
                     dialog.append(f"<|image_{image_idx}|>")
                     image_idx += 1
@@ -80,9 +73,6 @@ class Phi4MultimodalChatModel(BaseModel):
             clean_up_tokenization_spaces=False,
         )[0]
 
-        for f in files:
-            os.remove(f)
-
         return response
 
     def init_model(self):
@@ -1,15 +1,11 @@
-import os
-
 from models.base_model import BaseModel
-from utils.base64_to_file import save_base64_to_file
+from utils.media import save_to_tmpfs, tmpfs_files
 from qwen_vl_utils import process_vision_info
 
 
 class Qwen3_VL_VideoChatModel(BaseModel):
-    def _generate(self, messages):
+    def _to_qwen_messages(self, messages, tmp_files):
         msgs = []
-        tmp_files = []
-
         for m in messages:
             parts = []
             for p in m["content"]:
@@ -17,39 +13,43 @@ class Qwen3_VL_VideoChatModel(BaseModel):
                     parts.append({"type": "text", "text": p["text"]})
                 else:
                     b64 = p["video_url"]["url"]
-                    path = save_base64_to_file(b64, output_dir="tmp_video")
+                    path = save_to_tmpfs(b64, "tmp_video")
                     tmp_files.append(path)
                     parts.append({"type": "video", "video": f"file://{path}"})
             msgs.append({"role": m["role"], "content": parts})
+        return msgs
 
-        text = self.processor.apply_chat_template(
-            msgs, tokenize=False, add_generation_prompt=True
-        )
-        image_inputs, video_inputs, video_kwargs = process_vision_info(
-            msgs, return_video_kwargs=True
-        )
-        inputs = self.processor(
-            text=[text],
-            images=image_inputs,
-            videos=video_inputs,
-            padding=True,
-            return_tensors="pt",
-            **video_kwargs,
-        ).to(self.device)
+    def _generate(self, messages):
+        return self._generate_batch([messages])[0]
+
+    def _generate_batch(self, requests):
+        with tmpfs_files() as tmp_files:
+            conversations = [self._to_qwen_messages(messages, tmp_files) for messages in requests]
 
-        generated = self.model.generate(**inputs, max_new_tokens=self.max_new_tokens)
-        trimmed = [out[len(inp):] for inp, out in zip(inputs.input_ids, generated)]
-        out = self.processor.batch_decode(
-            trimmed, skip_special_tokens=True, clean_up_tokenization_spaces=False
-        )[0]
+            texts = [
+                self.processor.apply_chat_template(msgs, tokenize=False, add_generation_prompt=True)
+                for msgs in conversations
+            ]
+            # videos of all conversations in order, the processor splits them by the video tokens of each text
+            image_inputs, video_inputs, video_kwargs = process_vision_info(
+                conversations, return_video_kwargs=True
+            )
+            inputs = self.processor(
+                text=texts,
+                images=image_inputs,
+                videos=video_inputs,
+                padding=True,
+                return_tensors="pt",
+                **video_kwargs,
+            ).to(self.device)
 
-        for p in tmp_files:
-            try:
-                os.remove(p)
-            except Exception:
-                pass
+            generated = self.model.generate(**inputs, max_new_tokens=self.max_new_tokens)
+            trimmed = [out[len(inp):] for inp, out in zip(inputs.input_ids, generated)]
+            outs = self.processor.batch_decode(
+                trimmed, skip_special_tokens=True, clean_up_tokenization_spaces=False
+            )
 
-        return out
+            return outs
 
     def init_model(self):
         from transformers import AutoProcessor, Qwen3VLForConditionalGeneration
@@ -57,6 +57,8 @@ class Qwen3_VL_VideoChatModel(BaseModel):
         self.processor = AutoProcessor.from_pretrained(
             self.model_name, trust_remote_code=self.trust_remote_code
         )
+        # generation continues every row of a batch from its last token
+        self.processor.tokenizer.padding_side = "left"
         self.model = Qwen3VLForConditionalGeneration.from_pretrained(
             self.model_name,
             device_map=self.device,
@@ -4,14 +4,11 @@ import cv2
 import torch
 
 from models.base_model import BaseModel
-from utils.base64_to_file import save_base64_to_file
+from utils.media import TMPFS_DIR, save_to_tmpfs, tmpfs_files
 
 
 class Sa2VAInternVL3VideoChatModel(BaseModel):
     def _generate(self, messages):
-        tmp_paths = []
-        frames_dir = None
-
         all_texts = []
         videos_b64 = []
         for m in messages:
@@ -35,43 +32,31 @@ class Sa2VAInternVL3VideoChatModel(BaseModel):
         text_prompt = f"<image>{user_text}".strip() if user_text else "<image>"
 
         images_paths = None
-        if videos_b64:
-            v_b64 = videos_b64[0]
-            video_path = save_base64_to_file(v_b64, output_dir="tmp_video")
-            tmp_paths.append(video_path)
-
-            frames_dir = os.path.join("tmp_video_frames", uuid.uuid4().hex)
-            os.makedirs(frames_dir, exist_ok=True)
-            images_paths = self._extract_uniform_frames(video_path, frames_dir, max_frames=5)
-            tmp_paths.extend(images_paths)
-
-        input_dict = {
-            "text": text_prompt,
-            "past_text": past_text,
-            "mask_prompts": None,
-            "tokenizer": self.tokenizer,
-        }
-        if images_paths:
-            input_dict["video"] = images_paths
-
-        with torch.no_grad():
-            ret = self.model.predict_forward(**input_dict)
-
-        answer = ret.get("prediction", "")
-
-        for p in tmp_paths:
-            try:
-                os.remove(p)
-            except Exception:
-                pass
-
-        if frames_dir:
-            try:
-                os.rmdir(frames_dir)
-            except Exception:
-                pass
-
-        return answer
+        with tmpfs_files() as tmp_paths:
+            if videos_b64:
+                v_b64 = videos_b64[0]
+                video_path = save_to_tmpfs(v_b64, "tmp_video")
+                tmp_paths.append(video_path)
+
+                # OpenCV reads the video and the model reads the frames only from paths
+                frames_dir = os.path.join(TMPFS_DIR, "tmp_video_frames", uuid.uuid4().hex)
+                os.makedirs(frames_dir, exist_ok=True)
+                tmp_paths.append(frames_dir)
+                images_paths = self._extract_uniform_frames(video_path, frames_dir, max_frames=5)
+
+            input_dict = {
+                "text": text_prompt,
+                "past_text": past_text,
+                "mask_prompts": None,
+                "tokenizer": self.tokenizer,
+            }
+            if images_paths:
+                input_dict["video"] = images_paths
+
+            with torch.no_grad():
+                ret = self.model.predict_forward(**input_dict)
+
+        return ret.get("prediction", "")
 
     def _extract_uniform_frames(self, video_path, out_dir, max_frames=5):
         cap = cv2.VideoCapture(video_path)
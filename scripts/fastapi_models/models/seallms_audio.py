@@ -1,16 +1,13 @@
-import os
-import librosa
 import torch
 
 from transformers import AutoProcessor, Qwen2AudioForConditionalGeneration
 
 from models.base_model import BaseModel
-from utils.base64_to_file import save_base64_to_file
+from utils.media import load_audio
 
 
 class SeaLLMsAudioChatModel(BaseModel):
     def _generate(self, messages):
-        audio_files = []
         audios = []
         sr = self.processor.feature_extractor.sampling_rate
 
@@ -18,9 +15,7 @@ class SeaLLMsAudioChatModel(BaseModel):
             for part in m["content"]:
                 if part["type"] != "text":
                     b64 = part["audio_url"]["url"]
-                    audio_path = save_base64_to_file(b64, output_dir="tmp_audio")
-                    audio_files.append(audio_path)
-                    audio, _ = librosa.load(audio_path, sr=sr)
+                    audio, _ = load_audio(b64, sr=sr)
                     audios.append(audio)
 
         prompt = self.processor.apply_chat_template(
@@ -60,9 +55,6 @@ class SeaLLMsAudioChatModel(BaseModel):
             clean_up_tokenization_spaces=False,
         )[0]
 
-        for f in audio_files:
-            os.remove(f)
-
         return response
 
     def init_model(self):
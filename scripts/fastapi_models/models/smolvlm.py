@@ -1,44 +1,36 @@
-import os
 import torch
 
 from models.base_model import BaseModel
-from utils.base64_to_file import save_base64_to_file
+from utils.media import save_to_tmpfs, tmpfs_files
 
 
 class SmolVLM2VideoChatModel(BaseModel):
     def _generate(self, messages):
         msgs = []
-        tmp_files = []
-
-        for m in messages:
-            parts = []
-            for p in m["content"]:
-                if p["type"] == "text":
-                    parts.append({"type": "text", "text": p["text"]})
-                else:
-                    b64 = p["video_url"]["url"]
-                    path = save_base64_to_file(b64, output_dir="tmp_video")
-                    tmp_files.append(path)
-                    parts.append({"type": "video", "path": path})
-            msgs.append({"role": m["role"], "content": parts})
-        inputs = self.processor.apply_chat_template(
-            msgs,
-            add_generation_prompt=True,
-            tokenize=True,
-            return_dict=True,
-            return_tensors="pt",
-        ).to(self.device, dtype=torch.bfloat16)
-
-        out_ids = self.model.generate(**inputs, do_sample=False, max_new_tokens=self.max_new_tokens)
-        text = self.processor.batch_decode(out_ids, skip_special_tokens=True)[0]
-
-        for p in tmp_files:
-            try:
-                os.remove(p)
-            except:
-                pass
-
-        return text
+        with tmpfs_files() as tmp_files:
+            for m in messages:
+                parts = []
+                for p in m["content"]:
+                    if p["type"] == "text":
+                        parts.append({"type": "text", "text": p["text"]})
+                    else:
+                        b64 = p["video_url"]["url"]
+                        path = save_to_tmpfs(b64, "tmp_video")
+                        tmp_files.append(path)
+                        parts.append({"type": "video", "path": path})
+                msgs.append({"role": m["role"], "content": parts})
+            inputs = self.processor.apply_chat_template(
+                msgs,
+                add_generation_prompt=True,
+                tokenize=True,
+                return_dict=True,
+                return_tensors="pt",
+            ).to(self.device, dtype=torch.bfloat16)
+
+            out_ids = self.model.generate(**inputs, do_sample=False, max_new_tokens=self.max_new_tokens)
+            text = self.processor.batch_decode(out_ids, skip_special_tokens=True)[0]
+
+            return text
 
     def init_model(self):
         from transformers import AutoProcessor, AutoModelForImageTextToText
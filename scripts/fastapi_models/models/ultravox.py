@@ -1,18 +1,14 @@
-import os
-import librosa
 import transformers
 
 from models.base_model import BaseModel
-from utils.base64_to_file import save_base64_to_file
+from utils.media import load_audio
 
 
 class UltravoxChatModel(BaseModel):
     def _generate(self, messages):
-        audio_paths = []
         audio_arrays = []
 
         turns = []
-        audio_path = None
         audio_array = None
         sr = 16000
 
@@ -24,10 +20,8 @@ class UltravoxChatModel(BaseModel):
                     text_parts.append(part["text"])
                 else:
                     b64 = part["audio_url"]["url"]
-                    audio_path = save_base64_to_file(b64, output_dir="tmp_audio")
-                    audio_array, _ = librosa.load(audio_path, sr=sr)
+                    audio_array, _ = load_audio(b64, sr=sr)
                     text_parts.append("<|audio|>")
-                    audio_paths.append(audio_path)
                     audio_arrays.append(audio_array)
 
             text = "".join(text_parts)
@@ -43,9 +37,6 @@ class UltravoxChatModel(BaseModel):
 
         result = self.pipe(payload, max_new_tokens=self.max_new_tokens)
 
-        for audio_path in audio_paths:
-            os.remove(audio_path)
-
         return result
 
     def init_model(self):
@@ -0,0 +1,191 @@
+import base64
+import contextlib
+import hashlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Iterator, List, Optional, Tuple
+
+from utils.base64_to_file import save_base64_to_file
+
+# media for libraries that only accept a path are written to RAM backed storage when there is one
+TMPFS_DIR = os.getenv("MEDIA_TMP_DIR") or os.path.join(
+    "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "fastapi_media"
+)
+
+
+# decoded and preprocessed media kept in memory, 0 disables the cache
+MEDIA_DECODE_CACHE_BYTES = int(float(os.getenv("MEDIA_DECODE_CACHE_MB", "1024")) * 2 ** 20)
+
+
+def _nbytes(value) -> int:
+    if hasattr(value, "element_size") and hasattr(value, "numel"):
+        # torch.Tensor
+        return value.element_size() * value.numel()
+    if hasattr(value, "nbytes"):
+        # np.ndarray
+        return int(value.nbytes)
+    if hasattr(value, "getbands") and hasattr(value, "size"):
+        # PIL.Image
+        return value.size[0] * value.size[1] * len(value.getbands())
+    if isinstance(value, (list, tuple)):
+        return sum(_nbytes(item) for item in value)
+    if isinstance(value, dict):
+        return sum(_nbytes(item) for item in value.values())
+    return sys.getsizeof(value)
+
+
+class DecodedMediaCache:
+    """LRU of decoded / preprocessed media limited by the total size of the stored values."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key][0]
+            self.misses += 1
+
+        value = compute()
+        size = _nbytes(value)
+        if size > self.max_bytes:
+            return value
+
+        with self._lock:
+            if key not in self._items:
+                self._items[key] = (value, size)
+                self.used_bytes += size
+            while self.used_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._items.popitem(last=False)
+                self.used_bytes -= evicted_size
+        return value
+
+    def stats(self) -> dict:
+        return {
+            "items": len(self._items),
+            "used_bytes": self.used_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+decoded_media_cache = DecodedMediaCache(MEDIA_DECODE_CACHE_BYTES)
+
+
+def cached(data_url: str, kind: Hashable, compute: Callable[[], Any]) -> Any:
+    """
+    compute() for the payload, taken from the cache when the same payload was already
+    processed the same way. kind names the processing and its parameters. Callers must
+    not modify the returned objects in place.
+    """
+    if decoded_media_cache.max_bytes <= 0:
+        return compute()
+    key = (kind, hashlib.sha256(data_url.encode("utf-8")).hexdigest())
+    return decoded_media_cache.get_or_compute(key, compute)
+
+
+def decode_data_url(data_url: str) -> Tuple[str, bytes]:
+    """Mime type and decoded payload of a base64 data URL."""
+    if not data_url.startswith("data:"):
+        raise ValueError("Expected data URI scheme (starting with 'data:')")
+
+    header, encoded = data_url.split(",", 1)
+    mime = header.split(";")[0][5:]
+    if "/" not in mime:
+        raise ValueError(f"Invalid mime type in data URI: {mime}")
+
+    try:
+        binary = base64.b64decode(encoded, validate=True)
+    except Exception as e:
+        raise ValueError("Base64 decode error: " + str(e))
+    return mime, binary
+
+
+def media_buffer(data_url: str) -> io.BytesIO:
+    return io.BytesIO(decode_data_url(data_url)[1])
+
+
+def _decode_image(data_url: str):
+    from PIL import Image
+
+    image = Image.open(media_buffer(data_url))
+    # decode now, so a cached image holds its pixels
+    image.load()
+    return image if image.mode == "RGB" else image.convert("RGB")
+
+
+def load_image(data_url: str):
+    return cached(data_url, "image", lambda: _decode_image(data_url))
+
+
+def load_audio(data_url: str, sr: Optional[int] = None, mono: bool = True):
+    """
+    Waveform and sampling rate of an audio data URL, like librosa.load. sr=None keeps
+    the native rate.
+    """
+    return cached(data_url, ("audio", sr, mono), lambda: _decode_audio(data_url, sr, mono))
+
+
+def _decode_audio(data_url: str, sr: Optional[int], mono: bool):
+    import librosa
+    import soundfile as sf
+
+    buffer = media_buffer(data_url)
+    try:
+        audio, native_sr = sf.read(buffer, dtype="float32", always_2d=False)
+    except Exception:
+        # formats libsndfile can't read go through librosa's fallback decoders
+        buffer.seek(0)
+        return librosa.load(buffer, sr=sr, mono=mono)
+
+    if mono and audio.ndim > 1:
+        audio = audio.mean(axis=1)
+    elif not mono and audio.ndim > 1:
+        # librosa layout: channels first
+        audio = audio.T
+    if sr is not None and sr != native_sr:
+        audio = librosa.resample(audio, orig_sr=native_sr, target_sr=sr)
+        native_sr = sr
+    return audio, native_sr
+
+
+def save_to_tmpfs(data_url: str, subdir: str) -> str:
+    """Path to the decoded payload in TMPFS_DIR, for libraries that can't read from memory. The caller removes it."""
+    return save_base64_to_file(data_url, output_dir=os.path.join(TMPFS_DIR, subdir))
+
+
+@contextlib.contextmanager
+def tmpfs_files() -> Iterator[List[str]]:
+    """
+    List for the save_to_tmpfs paths (and temporary directories) of one request. They
+    are removed when the block exits, also when generation fails:
+
+        with tmpfs_files() as tmp_files:
+            tmp_files.append(save_to_tmpfs(b64, "tmp_video"))
+            ...
+    """
+    paths: List[str] = []
+    try:
+        yield paths
+    finally:
+        for path in paths:
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
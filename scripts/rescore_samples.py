@@ -0,0 +1,213 @@
+import argparse
+import glob
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from lm_eval.api.registry import get_aggregation, get_filter, get_metric, get_metric_aggregation
+from lm_eval.utils import load_yaml_config
+
+SAMPLES_SUFFIX = "samples_"
+OUTPUT_DATE_FORMAT = "%Y-%m-%dT%H-%M-%S.%f"
+DEFAULT_TASKS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "multimodal_tasks")
+# lm-eval applies this filter when the task yaml has no filter_list
+DEFAULT_FILTER_LIST = [{"name": "none", "filter": [{"function": "take_first"}]}]
+METRIC_CONFIG_KEYS = ("metric", "aggregation", "higher_is_better")
+# --write_samples marks its records with the source file, so that a rerun over the same dir skips them
+RESCORED_FROM_KEY = "rescored_from"
+
+
+def load_jsonl(path):
+    with open(path, encoding="utf-8") as file:
+        result = [json.loads(line) for line in file if line.strip()]
+    return result
+
+
+def save_jsonl(file, path):
+    with open(path, "w", encoding="utf-8") as outfile:
+        for entry in file:
+            json.dump(entry, outfile, ensure_ascii=False)
+            outfile.write("\n")
+
+
+def task_name_from_samples_path(path: str) -> str:
+    # samples_<task>_<date>.jsonl, the date has no underscores
+    file_name = os.path.basename(path)
+    return file_name[len(SAMPLES_SUFFIX):].rsplit("_", 1)[0]
+
+
+def find_task_yaml(task_name: str, tasks_dir: str) -> str:
+    for path in sorted(glob.glob(os.path.join(tasks_dir, "**", "*.yaml"), recursive=True)):
+        # simple mode leaves !function tags unresolved, so no task utils are imported here
+        config = load_yaml_config(yaml_path=path, mode="simple")
+        if config.get("task") == task_name:
+            return path
+    raise ValueError(f"No yaml with task: {task_name} in {tasks_dir}")
+
+
+def build_filters(filter_list: List[Dict[str, Any]]) -> List[Tuple[str, List[Any]]]:
+    filters = []
+    for filter_config in filter_list:
+        steps = []
+        for function in filter_config["filter"]:
+            kwargs = {key: value for key, value in function.items() if key != "function"}
+            steps.append(get_filter(function["function"])(**kwargs))
+        filters.append((filter_config["name"], steps))
+    return filters
+
+
+def build_metrics(metric_list: List[Dict[str, Any]]) -> List[Tuple[str, Callable, Dict[str, Any], Callable]]:
+    metrics = []
+    for metric_config in metric_list:
+        name = metric_config["metric"]
+        kwargs = {key: value for key, value in metric_config.items() if key not in METRIC_CONFIG_KEYS}
+        aggregation = metric_config.get("aggregation")
+        aggregation_fn = get_aggregation(aggregation) if isinstance(aggregation, str) else aggregation
+        if callable(name):
+            metrics.append((name.__name__, name, kwargs, aggregation_fn))
+        else:
+            metrics.append((name, get_metric(name), kwargs, aggregation_fn or get_aggregation(get_metric_aggregation(name))))
+    return metrics
+
+
+def apply_filter(steps: List[Any], resps: List[List[Any]], docs: List[Dict[str, Any]]) -> List[Any]:
+    # every filter works on the responses of all docs at once
+    for step in steps:
+        resps = list(step.apply(resps, docs))
+    return resps
+
+
+def default_process_results(metrics, target, result) -> Dict[str, Any]:
+    # generate_until branch of ConfigurableTask.process_results
+    scores = {}
+    for name, metric_fn, kwargs, _ in metrics:
+        score = metric_fn(references=[target], predictions=[result], **kwargs)
+        scores[name] = score[name] if isinstance(score, dict) else score
+    return scores
+
+
+def rescore_file(path: str, tasks_dir: str, write_samples: bool) -> Tuple[str, Dict[str, Any], int]:
+    task_name = task_name_from_samples_path(path)
+    config = load_yaml_config(yaml_path=find_task_yaml(task_name, tasks_dir), mode="full")
+    if config.get("output_type", "generate_until") != "generate_until":
+        raise ValueError(f"{task_name}: only generate_until tasks can be re-scored, got {config['output_type']}")
+
+    # lm-eval writes one line per (doc, filter), the raw responses are the same in all of them
+    records: Dict[int, Dict[str, Any]] = {}
+    for record in load_jsonl(path):
+        records.setdefault(record["doc_id"], record)
+    records = [records[doc_id] for doc_id in sorted(records)]
+    docs = [record["doc"] for record in records]
+    # resps of the only request of every doc
+    resps = [record["resps"][0] for record in records]
+
+    filters = build_filters(config.get("filter_list") or DEFAULT_FILTER_LIST)
+    metrics = build_metrics(config.get("metric_list") or [])
+    process_results: Optional[Callable] = config.get("process_results")
+
+    results = {"alias": task_name}
+    new_records = []
+    for filter_name, steps in filters:
+        filtered = apply_filter(steps, resps, docs)
+
+        per_doc = []
+        for record, doc, result in zip(records, docs, filtered):
+            if callable(process_results):
+                scores = process_results(doc, [result])
+            else:
+                scores = default_process_results(metrics, record["target"], result)
+            per_doc.append(scores)
+            if write_samples:
+                new_records.append(
+                    {
+                        **record,
+                        "filtered_resps": [result],
+                        "filter": filter_name,
+                        "metrics": list(scores.keys()),
+                        **scores,
+                        RESCORED_FROM_KEY: record.get(RESCORED_FROM_KEY, os.path.basename(path)),
+                    }
+                )
+
+        aggregations = {name: aggregation_fn for name, _, _, aggregation_fn in metrics}
+        for name in per_doc[0] if per_doc else []:
+            aggregation_fn = aggregations.get(name) or get_aggregation("mean")
+            results[f"{name},{filter_name}"] = aggregation_fn([scores[name] for scores in per_doc])
+
+    if write_samples:
+        date = datetime.now().strftime(OUTPUT_DATE_FORMAT)
+        save_jsonl(new_records, os.path.join(os.path.dirname(path), f"{SAMPLES_SUFFIX}{task_name}_{date}.jsonl"))
+
+    return task_name, results, len(records)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Re-apply filters and metrics of the task yamls to saved lm-eval samples without running the model"
+    )
+    parser.add_argument("--samples", type=str, nargs="+", help="samples_<task>_<date>.jsonl files or dirs with them")
+    parser.add_argument("--tasks_dir", type=str, default=DEFAULT_TASKS_DIR, help="dir with the task yamls")
+    parser.add_argument("--output_path", type=str, default=None, help="where to save results json")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of processes")
+    parser.add_argument(
+        "--write_samples",
+        action="store_true",
+        help="also write re-filtered samples_<task>_<new date>.jsonl next to the input files, "
+        "later runs over the same dir skip them",
+    )
+    return parser.parse_args()
+
+
+def is_rescored_file(path: str) -> bool:
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                return RESCORED_FROM_KEY in json.loads(line)
+    return False
+
+
+def collect_samples_files(paths: List[str]) -> List[str]:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for file in sorted(glob.glob(os.path.join(path, f"{SAMPLES_SUFFIX}*.jsonl"))):
+                # written by an earlier --write_samples run, its source file is in the dir too
+                if is_rescored_file(file):
+                    print(f"Skipping {file}: written by --write_samples")
+                    continue
+                files.append(file)
+        else:
+            files.append(path)
+    return files
+
+
+def main():
+    args = get_args()
+    files = collect_samples_files(args.samples)
+
+    results, n_samples = {}, {}
+    with ProcessPoolExecutor(max_workers=max(1, min(args.workers, len(files)))) as executor:
+        futures = {executor.submit(rescore_file, path, args.tasks_dir, args.write_samples): path for path in files}
+        for future, path in futures.items():
+            try:
+                task_name, task_results, n = future.result()
+            except Exception as e:
+                print(f"Skipping {path}: {e}")
+                continue
+            results[task_name] = task_results
+            n_samples[task_name] = n
+            print(task_name, json.dumps(task_results, ensure_ascii=False))
+
+    output_path = args.output_path or os.path.join(
+        os.path.dirname(files[0]) if files else ".",
+        f"results_rescored_{datetime.now().strftime(OUTPUT_DATE_FORMAT)}.json",
+    )
+    with open(output_path, "w", encoding="utf-8") as file:
+        json.dump({"results": results, "n-samples": n_samples}, file, ensure_ascii=False, indent=4)
+    print("Results saved to", output_path)
+
+
+if __name__ == "__main__":
+    main()